@@ -1,18 +1,26 @@
 """
-YouTube Cookie Manager using Selenium
-Selenium으로 로그인 후 쿠키를 Netscape 형식으로 직접 내보내기
+YouTube Cookie Manager
+OAuth refresh token 또는 Selenium으로 로그인 후 쿠키를 Netscape 형식으로 직접 내보내기
 """
 
 import os
 import time
+import queue
+import threading
 import subprocess
+from http.cookiejar import MozillaCookieJar
 from pathlib import Path
+
+import requests
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chromium.remote_connection import ChromiumRemoteConnection
+from selenium.webdriver.remote.client_config import ClientConfig
+from selenium.webdriver.remote.webdriver import WebDriver as RemoteWebDriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.common.keys import Keys
+from selenium.common.exceptions import TimeoutException
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -26,15 +34,54 @@ CHROME_PROFILE_DIR = Path("/app/chrome-profile")
 MOUNTED_COOKIE_FILE = Path("/app/cookies/cookies.txt")  # 수동으로 추출한 쿠키 파일 (마운트)
 AUTO_COOKIE_FILE = Path("/app/cookies/youtube_cookies.txt")  # 자동 생성된 쿠키 파일
 
+# 쿠키 파일 확인 결과 캐시 (매 호출마다 stat 하지 않도록 60초간 재사용)
+COOKIE_CACHE_TTL = 60
+_cookie_cache = (0.0, None)  # (확인 시각, 쿠키 파일 경로)
+_cookie_mtime_cache = (0.0, None)  # (확인 시각, 자동 생성 쿠키 파일 mtime)
+
+
 def get_cookie_file():
     """사용 가능한 쿠키 파일 반환 (마운트된 파일 우선)"""
+    global _cookie_cache
+    checked_at, cookie_file = _cookie_cache
+    now = time.time()
+    if now - checked_at < COOKIE_CACHE_TTL:
+        return cookie_file
+
+    cookie_file = None
     if MOUNTED_COOKIE_FILE.exists() and MOUNTED_COOKIE_FILE.stat().st_size > 100:
         print(f"[CookieManager] Using mounted cookie file: {MOUNTED_COOKIE_FILE}")
-        return MOUNTED_COOKIE_FILE
+        cookie_file = MOUNTED_COOKIE_FILE
     elif AUTO_COOKIE_FILE.exists() and AUTO_COOKIE_FILE.stat().st_size > 100:
         print(f"[CookieManager] Using auto-generated cookie file: {AUTO_COOKIE_FILE}")
-        return AUTO_COOKIE_FILE
-    return None
+        cookie_file = AUTO_COOKIE_FILE
+
+    _cookie_cache = (now, cookie_file)
+    return cookie_file
+
+
+def get_cookie_mtime():
+    """자동 생성 쿠키 파일의 mtime 반환 (없으면 None, 60초간 캐시)"""
+    global _cookie_mtime_cache
+    checked_at, mtime = _cookie_mtime_cache
+    now = time.time()
+    if now - checked_at < COOKIE_CACHE_TTL:
+        return mtime
+
+    try:
+        mtime = AUTO_COOKIE_FILE.stat().st_mtime
+    except FileNotFoundError:
+        mtime = None
+
+    _cookie_mtime_cache = (now, mtime)
+    return mtime
+
+
+def invalidate_cookie_cache():
+    """쿠키 파일이 새로 기록되면 캐시 무효화"""
+    global _cookie_cache, _cookie_mtime_cache
+    _cookie_cache = (0.0, None)
+    _cookie_mtime_cache = (0.0, None)
 
 # 호환성을 위한 COOKIE_FILE 변수
 COOKIE_FILE = AUTO_COOKIE_FILE
@@ -43,6 +90,64 @@ COOKIE_FILE = AUTO_COOKIE_FILE
 GOOGLE_EMAIL = os.getenv("GOOGLE_EMAIL")
 GOOGLE_PASSWORD = os.getenv("GOOGLE_PASSWORD")
 
+# OAuth refresh token (설정 시 브라우저 없이 HTTP 요청만으로 쿠키 발급)
+GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
+GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
+GOOGLE_REFRESH_TOKEN = os.getenv("GOOGLE_REFRESH_TOKEN")
+
+OAUTH_TOKEN_URL = "https://oauth2.googleapis.com/token"
+YOUTUBE_AUTH_COOKIES = ("SID", "HSID", "SSID", "APISID", "SAPISID")
+
+NETSCAPE_HEADER = (
+    b"# Netscape HTTP Cookie File\n"
+    b"# https://curl.haxx.se/rfc/cookie_spec.html\n"
+    b"# This is a generated file! Do not edit.\n"
+    b"\n"
+)
+
+# WebDriver HTTP 커넥션 풀 크기 (기본값 1이면 동시 CDP 요청이 직렬화됨)
+WEBDRIVER_POOL_MAXSIZE = 10
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+
+class PooledChromeDriver(webdriver.Chrome):
+    """
+    커넥션 풀 크기를 늘린 RemoteConnection으로 세션을 만드는 Chrome 드라이버
+
+    webdriver.Chrome은 client_config를 받지 않고 내부에서 RemoteConnection을 만들기 때문에,
+    서비스 시작과 세션 생성을 직접 수행해 처음부터 설정한 커넥션을 사용합니다.
+    (생성 후 command_executor를 교체하면 기존 커넥션의 urllib3 풀이 닫히지 않고 남음)
+    """
+
+    def __init__(self, service, options):
+        self.service = service
+        self.options = options
+        self.service.start()
+
+        # selenium은 dict 안의 "init_args_for_pool_manager" 키를 urllib3.PoolManager 인자로 사용
+        client_config = ClientConfig(
+            remote_server_addr=self.service.service_url,
+            keep_alive=True,
+            timeout=120,
+            init_args_for_pool_manager={
+                "init_args_for_pool_manager": {"maxsize": WEBDRIVER_POOL_MAXSIZE, "block": False}
+            },
+        )
+        executor = ChromiumRemoteConnection(
+            remote_server_addr=self.service.service_url,
+            vendor_prefix="goog",
+            browser_name="chrome",
+            client_config=client_config,
+        )
+
+        try:
+            RemoteWebDriver.__init__(self, command_executor=executor, options=self.options)
+        except Exception:
+            self.quit()
+            raise
+        self._is_remote = False
+
 
 def get_chrome_driver(use_incognito=False):
     """
@@ -62,7 +167,7 @@ def get_chrome_driver(use_incognito=False):
     options.add_argument("--disable-gpu")
     options.add_argument("--disable-blink-features=AutomationControlled")
     options.add_argument("--window-size=1920,1080")
-    options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+    options.add_argument(f"--user-agent={USER_AGENT}")
 
     # Incognito 모드 또는 영구 프로필
     if use_incognito:
@@ -82,9 +187,15 @@ def get_chrome_driver(use_incognito=False):
     from selenium.webdriver.chrome.service import Service
     service = Service("/usr/bin/chromedriver")
 
-    driver = webdriver.Chrome(service=service, options=options)
+    driver = PooledChromeDriver(service=service, options=options)
+
+    hide_webdriver_flag(driver)
+
+    return driver
 
-    # webdriver 속성 숨기기
+
+def hide_webdriver_flag(driver):
+    """현재 탭에서 navigator.webdriver 속성 숨기기"""
     try:
         driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
             "source": """
@@ -96,7 +207,84 @@ def get_chrome_driver(use_incognito=False):
     except:
         pass
 
-    return driver
+
+# 동시에 띄워둘 Chromium 드라이버 수
+POOL_SIZE = 1
+
+
+class ChromeDriverPool:
+    """
+    Chromium 드라이버를 한 번만 띄우고 재사용하는 풀
+
+    쿠키 갱신마다 chromedriver + Chromium 프로세스를 새로 띄우지 않고,
+    첫 acquire() 시 생성한 드라이버를 계속 재사용합니다.
+    """
+
+    def __init__(self, size=POOL_SIZE):
+        self._size = size
+        self._created = 0
+        self._lock = threading.Lock()
+        self._idle = queue.Queue(maxsize=size)
+
+    def acquire(self):
+        """유휴 드라이버 반환, 없으면 최대 size개까지 새로 생성"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self._size:
+                driver = get_chrome_driver(use_incognito=False)
+                self._created += 1
+                print("[CookieManager] Chrome driver started (pooled)")
+                return driver
+
+        return self._idle.get()
+
+    def release(self, driver):
+        """사용이 끝난 드라이버를 풀에 반환"""
+        self._idle.put(driver)
+
+    def discard(self, driver):
+        """오류가 난 드라이버 종료 (다음 acquire에서 새로 생성)"""
+        try:
+            driver.quit()
+        except:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def shutdown(self):
+        """풀의 모든 드라이버 종료"""
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(driver)
+
+
+_driver_pool = ChromeDriverPool()
+
+
+def shutdown_browser_pool():
+    """서버 종료 시 풀링된 드라이버 정리"""
+    _driver_pool.shutdown()
+
+
+def insert_text_and_submit(driver, element, text):
+    """
+    CDP로 입력창에 텍스트를 한 번에 입력하고 Enter 전송
+
+    send_keys는 글자마다 WebDriver 요청을 보내므로,
+    Input.insertText 한 번으로 전체 문자열을 입력합니다.
+    """
+    element.click()
+    driver.execute_cdp_cmd("Input.insertText", {"text": text})
+    enter_key = {"key": "Enter", "code": "Enter", "windowsVirtualKeyCode": 13}
+    driver.execute_cdp_cmd("Input.dispatchKeyEvent", {"type": "keyDown", "text": "\r", **enter_key})
+    driver.execute_cdp_cmd("Input.dispatchKeyEvent", {"type": "keyUp", **enter_key})
 
 
 def google_login(driver):
@@ -110,32 +298,33 @@ def google_login(driver):
 
         # Google 로그인 페이지로 이동
         driver.get("https://accounts.google.com/signin/v2/identifier?service=youtube")
-        time.sleep(3)
 
         # 이메일 입력
         try:
-            email_input = WebDriverWait(driver, 10).until(
+            email_input = WebDriverWait(driver, 15, poll_frequency=0.2).until(
                 EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='email']"))
             )
             email_input.clear()
-            email_input.send_keys(GOOGLE_EMAIL)
-            email_input.send_keys(Keys.RETURN)
+            insert_text_and_submit(driver, email_input, GOOGLE_EMAIL)
             print("[CookieManager] Email entered")
-            time.sleep(3)
         except Exception as e:
             print(f"[CookieManager] Failed to enter email: {str(e)}")
             return False
 
         # 비밀번호 입력
         try:
-            password_input = WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "input[type='password']"))
+            # 이메일 제출 후 비밀번호 입력창이 활성화될 때까지 대기
+            password_input = WebDriverWait(driver, 15, poll_frequency=0.2).until(
+                EC.element_to_be_clickable((By.CSS_SELECTOR, "input[type='password']"))
             )
             password_input.clear()
-            password_input.send_keys(GOOGLE_PASSWORD)
-            password_input.send_keys(Keys.RETURN)
+            insert_text_and_submit(driver, password_input, GOOGLE_PASSWORD)
             print("[CookieManager] Password entered")
-            time.sleep(5)
+            # 비밀번호 제출 후 페이지 이동 대기
+            try:
+                WebDriverWait(driver, 15, poll_frequency=0.2).until(EC.staleness_of(password_input))
+            except TimeoutException:
+                pass
         except Exception as e:
             print(f"[CookieManager] Failed to enter password: {str(e)}")
             return False
@@ -144,20 +333,17 @@ def google_login(driver):
         # 문서: https://github.com/yt-dlp/yt-dlp/wiki/FAQ#how-do-i-pass-cookies-to-yt-dlp
         print("[CookieManager] Navigating to robots.txt to prevent cookie rotation...")
         driver.get("https://www.youtube.com/robots.txt")
-        time.sleep(3)
 
-        # 로그인 상태 확인 (YouTube 메인으로 이동)
+        # 로그인 상태 확인 (YouTube 메인으로 이동, 아바타가 나타날 때까지 대기)
         driver.get("https://www.youtube.com")
-        time.sleep(2)
 
         try:
-            WebDriverWait(driver, 5).until(
+            WebDriverWait(driver, 10, poll_frequency=0.2).until(
                 EC.presence_of_element_located((By.CSS_SELECTOR, "button#avatar-btn, img#img[alt*='Avatar'], ytd-topbar-menu-button-renderer"))
             )
             print("[CookieManager] Login successful!")
             # 다시 robots.txt로 이동해서 쿠키를 안전하게 유지
             driver.get("https://www.youtube.com/robots.txt")
-            time.sleep(2)
             return True
         except:
             print("[CookieManager] Login verification failed - may require 2FA or CAPTCHA")
@@ -179,37 +365,33 @@ def export_cookies_to_netscape(driver, output_path):
     try:
         cookies = driver.get_cookies()
 
-        # Netscape 쿠키 파일 형식으로 작성
-        lines = ["# Netscape HTTP Cookie File"]
-        lines.append("# https://curl.haxx.se/rfc/cookie_spec.html")
-        lines.append("# This is a generated file! Do not edit.")
-        lines.append("")  # 빈 줄 추가
-
-        for cookie in cookies:
-            # domain, flag, path, secure, expiration, name, value
-            domain = cookie.get('domain', '')
-            # domain이 .으로 시작하면 TRUE, 아니면 FALSE
-            flag = "TRUE" if domain.startswith('.') else "FALSE"
-            path = cookie.get('path', '/')
-            secure = "TRUE" if cookie.get('secure', False) else "FALSE"
-            # 만료 시간 (없으면 세션 쿠키 - 0)
-            expiry = cookie.get('expiry', 0)
-            if expiry == 0:
-                expiry = int(time.time()) + 86400 * 365  # 1년 후
-            name = cookie.get('name', '')
-            value = cookie.get('value', '')
-
-            line = f"{domain}\t{flag}\t{path}\t{secure}\t{expiry}\t{name}\t{value}"
-            lines.append(line)
-
-        # 파일로 저장
+        # 세션 쿠키(만료 시간 없음)는 1년 후 만료로 기록
+        default_expiry = int(time.time()) + 86400 * 365
+
+        def netscape_lines():
+            # domain, flag(domain이 .으로 시작하면 TRUE), path, secure, expiration, name, value
+            for cookie in cookies:
+                domain = cookie.get('domain', '')
+                flag = "TRUE" if domain.startswith('.') else "FALSE"
+                secure = "TRUE" if cookie.get('secure', False) else "FALSE"
+                expiry = cookie.get('expiry') or default_expiry
+                yield (
+                    f"{domain}\t{flag}\t{cookie.get('path', '/')}\t{secure}\t{expiry}\t"
+                    f"{cookie.get('name', '')}\t{cookie.get('value', '')}\n"
+                ).encode()
+
+        # 파일로 저장 (중간 join 없이 1MiB 버퍼로 한 번에 기록)
         output_path = Path(output_path)
         output_path.parent.mkdir(parents=True, exist_ok=True)
 
-        with open(output_path, 'w', newline='\n') as f:
-            f.write('\n'.join(lines))
-            f.write('\n')  # 파일 끝 개행
+        # 임시 파일에 쓴 뒤 원자적으로 교체 (중간에 실패해도 잘린 쿠키 파일이 남지 않음)
+        tmp_path = output_path.with_suffix(output_path.suffix + ".tmp")
+        with open(tmp_path, 'wb', buffering=1 << 20) as f:
+            f.write(NETSCAPE_HEADER)
+            f.writelines(netscape_lines())
+        os.replace(tmp_path, output_path)
 
+        invalidate_cookie_cache()
         print(f"[CookieManager] Exported {len(cookies)} cookies to {output_path}")
         return True
 
@@ -218,52 +400,132 @@ def export_cookies_to_netscape(driver, output_path):
         return False
 
 
+def fetch_cookies_via_oauth(output_path):
+    """
+    저장된 refresh token으로 브라우저 없이 YouTube 쿠키 발급
+
+    1. refresh token으로 access token 발급 (oauth2.googleapis.com/token)
+    2. access token으로 uberauth 토큰 발급 (OAuthLogin)
+    3. MergeSession으로 youtube.com 세션 쿠키(SID, SAPISID 등) 발급
+    4. 쿠키 jar를 Netscape 형식으로 바로 저장
+    """
+    if not (GOOGLE_REFRESH_TOKEN and GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET):
+        print("[CookieManager] OAuth refresh token not configured, skipping HTTP login")
+        return False
+
+    try:
+        print("[CookieManager] Fetching cookies via OAuth refresh token...")
+        jar = MozillaCookieJar()
+
+        with requests.Session() as session:
+            session.cookies = jar
+            session.headers["User-Agent"] = USER_AGENT
+
+            token_response = session.post(OAUTH_TOKEN_URL, data={
+                "client_id": GOOGLE_CLIENT_ID,
+                "client_secret": GOOGLE_CLIENT_SECRET,
+                "refresh_token": GOOGLE_REFRESH_TOKEN,
+                "grant_type": "refresh_token",
+            }, timeout=10)
+            token_response.raise_for_status()
+            access_token = token_response.json()["access_token"]
+
+            uberauth_response = session.get(
+                "https://accounts.google.com/OAuthLogin",
+                params={"source": "ChromiumBrowser", "issueuberauth": "1"},
+                headers={"Authorization": f"Bearer {access_token}"},
+                timeout=10,
+            )
+            uberauth_response.raise_for_status()
+
+            # robots.txt로 이동하여 쿠키 rotation 방지
+            session.get(
+                "https://accounts.google.com/MergeSession",
+                params={
+                    "uberauth": uberauth_response.text.strip(),
+                    "continue": "https://www.youtube.com/robots.txt",
+                    "source": "ChromiumBrowser",
+                },
+                timeout=10,
+            ).raise_for_status()
+
+        names = {cookie.name for cookie in jar if cookie.domain.endswith("youtube.com")}
+        missing = [name for name in YOUTUBE_AUTH_COOKIES if name not in names]
+        if missing:
+            print(f"[CookieManager] OAuth login did not return auth cookies: {missing}")
+            return False
+
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = output_path.with_suffix(output_path.suffix + ".tmp")
+        jar.save(str(tmp_path), ignore_discard=True, ignore_expires=True)
+        os.replace(tmp_path, output_path)
+
+        invalidate_cookie_cache()
+        print(f"[CookieManager] Exported {len(jar)} cookies to {output_path}")
+        return True
+
+    except Exception as e:
+        print(f"[CookieManager] OAuth cookie fetch failed: {str(e)}")
+        return False
+
+
+def has_auth_cookies(driver):
+    """현재 브라우저 세션에 YouTube 인증 쿠키(SID, SAPISID)가 있는지 확인"""
+    names = {cookie.get('name') for cookie in driver.get_cookies()}
+    return "SID" in names and "SAPISID" in names
+
+
 def setup_browser_profile():
     """
-    Incognito 모드로 로그인 후 쿠키를 Netscape 형식으로 내보내기
+    영구 프로필 브라우저에서 로그인 후 쿠키를 Netscape 형식으로 내보내기
 
-    YouTube의 쿠키 rotation을 방지하기 위한 권장 방식:
-    1. Incognito/Private 창에서 로그인
-    2. robots.txt로 이동
-    3. 쿠키 추출
-    4. 즉시 브라우저 종료
+    1. 영구 프로필(CHROME_PROFILE_DIR)로 robots.txt 이동
+    2. 인증 쿠키가 이미 있으면 로그인 생략 (캐시/세션 재사용)
+    3. 없을 때만 Google 로그인 (로그인 후 robots.txt로 이동하여 rotation 방지)
+    4. 쿠키 추출
 
     참고: https://github.com/yt-dlp/yt-dlp/wiki/FAQ#exporting-youtube-cookies
     """
     driver = None
     try:
-        print("[CookieManager] Setting up browser profile (incognito mode)...")
-        # Incognito 모드로 드라이버 생성
-        driver = get_chrome_driver(use_incognito=True)
+        driver = _driver_pool.acquire()
+        print("[CookieManager] Setting up browser profile (persistent profile)...")
 
-        # Google 로그인 시도 (로그인 후 자동으로 robots.txt로 이동됨)
-        login_success = google_login(driver)
+        driver.get("https://www.youtube.com/robots.txt")
+        if has_auth_cookies(driver):
+            print("[CookieManager] Existing login session found in profile, skipping login")
+            login_success = True
+        else:
+            # Google 로그인 시도 (로그인 후 자동으로 robots.txt로 이동됨)
+            login_success = google_login(driver)
 
         if login_success:
-            # 쿠키를 Netscape 형식으로 즉시 내보내기
             # 추가 페이지 방문 없이 바로 쿠키 추출 (rotation 방지)
             export_cookies_to_netscape(driver, COOKIE_FILE)
-            print("[CookieManager] Cookie extraction complete. Closing incognito session...")
+            print("[CookieManager] Cookie extraction complete")
 
+        _driver_pool.release(driver)
         return login_success
 
     except Exception as e:
         print(f"[CookieManager] Error: {str(e)}")
-        return False
-    finally:
         if driver:
-            # Incognito 세션을 즉시 종료하여 쿠키 rotation 방지
-            driver.quit()
-            print("[CookieManager] Incognito session closed")
+            _driver_pool.discard(driver)
+        return False
 
 
 def fetch_youtube_cookies():
     """
-    Incognito 모드에서 브라우저 로그인 후 쿠키 추출
+    YouTube 쿠키 발급
+
+    1. GOOGLE_REFRESH_TOKEN이 있으면 HTTP 요청만으로 쿠키 발급 (브라우저 불필요)
+    2. 실패하거나 설정되지 않았으면 영구 프로필 브라우저에서 쿠키 추출 (필요할 때만 로그인)
 
     주의: --cookies-from-browser 방식은 사용하지 않음 (yt-dlp FAQ 권장사항)
-    대신 Selenium으로 직접 쿠키를 Netscape 형식으로 추출
     """
+    if fetch_cookies_via_oauth(COOKIE_FILE):
+        return True
     return setup_browser_profile()
 
 
@@ -280,10 +542,10 @@ def get_cookie_file_path():
 
 def refresh_cookies_if_needed():
     """쿠키가 오래되었으면 갱신 (6시간 기준)"""
-    if not COOKIE_FILE.exists():
+    mtime = get_cookie_mtime()
+    if mtime is None:
         return fetch_youtube_cookies()
 
-    mtime = COOKIE_FILE.stat().st_mtime
     age_hours = (time.time() - mtime) / 3600
 
     if age_hours > 6:
@@ -0,0 +1,69 @@
+"""
+디스크 캐시 공용 함수
+
+생성 이미지 캐시(image_generator)와 오디오 캐시(main)가 함께 사용합니다.
+"""
+
+import os
+import uuid
+import shutil
+from pathlib import Path
+from typing import Optional
+
+
+def link_or_copy(src: Path, dst: Path):
+    """
+    하드링크로 파일 공유 (다른 파일시스템 등으로 실패하면 복사)
+
+    임시 파일에 만든 뒤 os.replace로 교체하므로, dst가 이미 있어도
+    그 파일(캐시와 하드링크되었을 수 있음)에 덮어쓰지 않음
+    """
+    tmp_path = dst.with_name(f"{dst.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        try:
+            os.link(src, tmp_path)
+        except OSError:
+            shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def use_cached(cache_path: Path, output_path: Path):
+    """캐시 파일을 세션 경로로 연결하고 mtime을 갱신 (LRU 순서 유지)"""
+    link_or_copy(cache_path, output_path)
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+
+
+def prune_cache(cache_dir: Path, suffix: str, max_files: int, max_bytes: Optional[int] = None):
+    """
+    cache_dir에서 suffix로 끝나는 파일을 mtime 기준 LRU로 정리 (개수/용량 한도 초과분 삭제)
+    """
+    entries = []
+    try:
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith(suffix):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return
+
+    entries.sort()
+    total_bytes = sum(size for _, size, _ in entries)
+    count = len(entries)
+    for _, size, path in entries:
+        if count <= max_files and (max_bytes is None or total_bytes <= max_bytes):
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        count -= 1
+        total_bytes -= size
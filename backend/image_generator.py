@@ -7,112 +7,261 @@ Gemini 3 Pro Image Generation Module (Nano Banana Pro)
 
 import os
 import asyncio
+import hashlib
+import threading
 from pathlib import Path
 from typing import Optional
 
+import httpx
 from google import genai
 from google.genai import types
 
+from file_cache import link_or_copy, prune_cache, use_cached
 
-def get_genai_client() -> genai.Client:
-    """Gemini API 클라이언트 생성"""
-    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("gemini")
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY or gemini not found in environment variables")
-    return genai.Client(api_key=api_key)
 
+# YouTube 썸네일 프롬프트 (16:9)
+_YT_PROMPT = """Based on this provided image, create a cinematic 16:9 YouTube thumbnail for a music playlist.
+Apply professional cinematic touch with a soft, slightly desaturated color grade and subtle film grain texture for a moody, calm atmosphere.
+In the dead center, add the word "playlist" in an elegant, clean, understated white serif font.
+Directly underneath the word "playlist", include a thin, horizontal music playback progress bar or a subtle audio waveform visualizer that matches the exact width of the text.
+High quality, 4k resolution, photography style, evocative and eye-catching.
+Keep the essence and character of the original image while applying these transformations."""
 
-def extract_mood_keywords(mood_data: dict) -> str:
-    """mood 데이터에서 키워드 문자열 추출"""
-    keywords = []
-    for category, data in mood_data.items():
-        if isinstance(data, dict) and "selected" in data:
-            keywords.append(f"{data['selected']} ({data.get('intensity', 50)}%)")
-    return ", ".join(keywords)
+# LP 커버 프롬프트
+_LP_PROMPT = """[일러스트,앨범커버 변환 프롬프트] 
+프롬프트:
+제공된 사진을 바탕으로 따뜻하고 포근한 손그림 회화 스타일의 일러스트를 제작하고, 이를 상세한 바이닐(LP) 앨범 커버 목업에 적용해줘. 전체 이미지 비율은 16:9 와이드스크린이며, 배경은 완전한 순백색이다.
 
+1. 일러스트레이션 스타일:
 
-def load_image_as_part(image_path: str) -> types.Part:
-    """이미지 파일을 Gemini API Part로 변환"""
+원본 사진의 구도와 피사체는 완벽하게 유지하되, 사진적인 질감은 완전히 제거한다.
+붓 자국이 선명하게 느껴지는 두터운 유화 또는 아크릴 페인팅 질감으로 표현한다.
+세부 디테일은 과감하게 단순화하고, 전체적인 형태와 따뜻한 분위기 위주로 묘사한다. 전체적인 사진의 밝기는  유지하고 사진의 색깔도 그대로 사용하되 부드럽고 온화하게 섞인 페인터리 톤(그림책이나 손그림 애니메이션 배경 느낌)으로 바꾼다. (지브리 스타일 모방 금지)
+
+2. 상세 목업 구성 (핵심):
+
+화면 중앙에 **정사각형의 바이닐 레코드 슬리브(커버)**가 위치한다. 슬리브는 약간 거친 무광 질감의 두꺼운 종이 재질로 표현되어야 한다.
+이 슬리브의 앞면 전체에 위에서 제작한 회화 일러스트가 인쇄되어 있다.
+슬리브의 오른쪽 측면 입구로 **검은색 바이닐 레코드(LP판)**가 미끄러져 나오고 있다.
+레코드는 전체의 약 3분의 1(1/3) 정도만 슬리브 밖으로 노출되어 있어야 한다.
+노출된 레코드 표면에는 동심원의 소리 골(groove) 디테일이 보여야 하며, 레코드 중앙에는 원형 종이 라벨이 붙어 있다.
+이 중앙 원형 라벨에도 커버와 동일한 일러스트가 작게 크롭되어 들어가야 한다.
+3. 레이아웃 및 배경:
+
+이 모든 목업 구성 요소(슬리브와 빠져나온 레코드)는 아무런 무늬나 그림자가 없는 깨끗한 순백색(#FFFFFF) 배경 정중앙에 배치된다.
+부드럽고 자연스러운 스튜디오 조명을 사용하여 입체감을 준다."""
+
+# 썸네일 + LP 커버를 한 번에 요청하는 프롬프트
+_FUSED_PROMPT = f"""Create TWO separate images based on this provided image, in the order below.
+
+IMAGE 1 (YouTube thumbnail, 16:9):
+{_YT_PROMPT}
+
+IMAGE 2 (LP cover):
+{_LP_PROMPT}
+
+Output exactly two images: IMAGE 1 first, then IMAGE 2."""
+
+# 공유 Gemini 클라이언트 (커넥션 재사용)
+_client: Optional[genai.Client] = None
+_client_lock = threading.Lock()
+
+
+def get_genai_client() -> genai.Client:
+    """Gemini API 클라이언트 반환 (최초 1회만 생성)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                api_key = os.getenv("GEMINI_API_KEY") or os.getenv("gemini")
+                if not api_key:
+                    raise ValueError("GEMINI_API_KEY or gemini not found in environment variables")
+                # 비동기 클라이언트(client.aio)가 사용할 HTTP/2 keep-alive 커넥션 풀
+                async_http_client = httpx.AsyncClient(
+                    http2=True,
+                    limits=httpx.Limits(
+                        max_connections=32,
+                        max_keepalive_connections=32,
+                        keepalive_expiry=300,
+                    ),
+                )
+                _client = genai.Client(
+                    api_key=api_key,
+                    http_options=types.HttpOptions(httpx_async_client=async_http_client),
+                )
+    return _client
+
+
+# 확장자(점 제외) → mime type
+_MIME_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "gif": "image/gif",
+    "webp": "image/webp",
+}
+
+
+def _load_bytes(image_path: str) -> tuple[bytes, str]:
+    """이미지 파일을 읽어 (bytes, mime type) 반환"""
     with open(image_path, "rb") as f:
         image_bytes = f.read()
 
     # 확장자로 mime type 결정
-    ext = Path(image_path).suffix.lower()
-    mime_types = {
-        ".png": "image/png",
-        ".jpg": "image/jpeg",
-        ".jpeg": "image/jpeg",
-        ".gif": "image/gif",
-        ".webp": "image/webp",
-    }
-    mime_type = mime_types.get(ext, "image/png")
+    ext = image_path.rpartition(".")[2].lower()
+    mime_type = _MIME_TYPES.get(ext, "image/png")
+
+    return image_bytes, mime_type
 
+
+def load_image_as_part(image_path: str) -> types.Part:
+    """이미지 파일을 Gemini API Part로 변환"""
+    image_bytes, mime_type = _load_bytes(image_path)
     return types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
 
 
+# 프롬프트를 수정하면 올려서 기존 디스크 캐시를 무효화
+PROMPT_VERSION = "1"
+
+# 디스크 캐시에 보관할 최대 이미지 수 (초과하면 오래 사용되지 않은 것부터 삭제)
+IMAGE_CACHE_MAX_FILES = 200
+
+# 진행 중인 이미지 생성 요청 (같은 입력 이미지 + 프롬프트 요청은 결과 공유)
+_in_flight: dict[str, asyncio.Task] = {}
+
+
+def _request_key(image_part: Optional[types.Part], variant: str) -> Optional[str]:
+    """입력 이미지 bytes와 프롬프트 종류/버전으로 요청 키 생성 (입력 이미지가 없으면 None)"""
+    if image_part is None:
+        return None
+    image_bytes = image_part.inline_data.data
+    suffix = f"|{variant}|{PROMPT_VERSION}".encode()
+    return hashlib.blake2b(image_bytes + suffix, digest_size=16).hexdigest()
+
+
+def _cache_path(output_dir: Path, key: Optional[str], variant: str) -> Optional[Path]:
+    """생성 이미지 디스크 캐시 경로 (output_dir/.cache/)"""
+    if key is None:
+        return None
+    return output_dir / ".cache" / f"{key}_{variant}.png"
+
+
+def _write_atomic(output_path: Path, data: bytes):
+    """
+    이미지 데이터를 파일로 저장 (1MiB 버퍼로 한 번에 기록)
+
+    .tmp 파일에 먼저 쓴 뒤 os.replace로 교체하여 중간에 실패해도 잘린 파일이 남지 않음
+    """
+    tmp_path = output_path.with_suffix(output_path.suffix + ".tmp")
+    try:
+        with open(tmp_path, "wb", buffering=1 << 20) as f:
+            f.write(data)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def _store_in_cache(output_path: Path, cache_path: Optional[Path]):
+    """
+    생성된 이미지를 캐시에 등록 (임시 파일에 링크 후 원자적으로 교체)
+
+    링크/복사와 캐시 디렉토리 정리는 블로킹 파일 작업이므로 asyncio.to_thread로 호출
+    """
+    if cache_path is None:
+        return
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        link_or_copy(output_path, cache_path)
+        prune_cache(cache_path.parent, ".png", IMAGE_CACHE_MAX_FILES)
+    except OSError as e:
+        print(f"[ImageGen] Failed to cache {output_path}: {str(e)}")
+
+
+async def _call_image_model(contents) -> list[bytes]:
+    """Gemini 이미지 모델 호출 후 응답에 포함된 이미지 데이터를 순서대로 반환"""
+    client = get_genai_client()
+    response = await client.aio.models.generate_content(
+        model="gemini-3-pro-image-preview",
+        contents=contents,
+        config=types.GenerateContentConfig(
+            response_modalities=['IMAGE'],
+            candidate_count=1
+        )
+    )
+
+    return [
+        part.inline_data.data
+        for part in response.candidates[0].content.parts
+        if part.inline_data is not None
+    ]
+
+
+async def _generate_image_data(contents, key: Optional[str]) -> list[bytes]:
+    """
+    이미지 생성 (동일한 요청이 이미 진행 중이면 새로 호출하지 않고 그 결과를 기다림)
+    """
+    if key is None:
+        return await _call_image_model(contents)
+
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.create_task(_call_image_model(contents))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+    else:
+        print(f"[ImageGen] Joining in-flight request {key}")
+
+    # 한 요청이 취소되어도 공유 중인 생성 작업은 계속 진행
+    return await asyncio.shield(task)
+
+
 async def generate_youtube_thumbnail(
-    mood_data: dict,
     analysis: str,
     session_id: str,
     output_dir: Path,
-    image_path: Optional[str] = None
+    image_part: Optional[types.Part] = None
 ) -> Optional[str]:
     """
     YouTube 썸네일 이미지 생성 (16:9 비율)
 
     Args:
-        mood_data: Gemini 무드 분석 결과
         analysis: 이미지 분석 텍스트
         session_id: 세션 ID
         output_dir: 출력 디렉토리
-        image_path: 입력 이미지 경로 (선택사항)
+        image_part: 입력 이미지 Part (선택사항)
 
     Returns:
         생성된 이미지 파일 경로 (실패시 None)
     """
     try:
-        client = get_genai_client()
-        keywords = extract_mood_keywords(mood_data)
+        output_path = output_dir / f"{session_id}_youtube.png"
+        key = _request_key(image_part, "yt")
+        cache_path = _cache_path(output_dir, key, "yt")
 
-        prompt = f"""Based on this provided image, create a cinematic 16:9 YouTube thumbnail for a music playlist.
-Apply professional cinematic touch with a soft, slightly desaturated color grade and subtle film grain texture for a moody, calm atmosphere.
-In the dead center, add the word "playlist" in an elegant, clean, understated white serif font.
-Directly underneath the word "playlist", include a thin, horizontal music playback progress bar or a subtle audio waveform visualizer that matches the exact width of the text.
-High quality, 4k resolution, photography style, evocative and eye-catching.
-Keep the essence and character of the original image while applying these transformations."""
+        # 같은 입력 이미지로 생성한 결과가 캐시에 있으면 재사용
+        if cache_path is not None and cache_path.exists():
+            await asyncio.to_thread(use_cached, cache_path, output_path)
+            print(f"[ImageGen] YouTube thumbnail cache hit: {output_path}")
+            return str(output_path)
 
         # 이미지와 프롬프트를 함께 전달
-        if image_path and Path(image_path).exists():
-            image_part = load_image_as_part(image_path)
-            contents = [image_part, prompt]
-            print(f"[ImageGen] YouTube thumbnail: Using input image {image_path}")
+        if image_part is not None:
+            contents = [image_part, _YT_PROMPT]
+            print(f"[ImageGen] YouTube thumbnail: Using input image")
         else:
-            contents = prompt
+            contents = _YT_PROMPT
             print(f"[ImageGen] YouTube thumbnail: No input image, generating from prompt only")
 
-        response = await asyncio.to_thread(
-            client.models.generate_content,
-            model="gemini-3-pro-image-preview",
-            contents=contents,
-            config=types.GenerateContentConfig(
-                response_modalities=['IMAGE']
-            )
-        )
-
-        # 이미지 추출 및 저장
-        output_path = output_dir / f"{session_id}_youtube.png"
-
-        for part in response.candidates[0].content.parts:
-            if part.inline_data is not None:
-                image = part.inline_data
-                # 이미지 데이터를 파일로 저장
-                with open(output_path, "wb") as f:
-                    f.write(image.data)
-                print(f"[ImageGen] YouTube thumbnail saved: {output_path}")
-                return str(output_path)
+        images = await _generate_image_data(contents, key)
+        if not images:
+            print(f"[ImageGen] No image data in response for YouTube thumbnail")
+            return None
 
-        print(f"[ImageGen] No image data in response for YouTube thumbnail")
-        return None
+        _write_atomic(output_path, images[0])
+        await asyncio.to_thread(_store_in_cache, output_path, cache_path)
+        print(f"[ImageGen] YouTube thumbnail saved: {output_path}")
+        return str(output_path)
 
     except Exception as e:
         print(f"[ImageGen] YouTube thumbnail generation failed: {str(e)}")
@@ -120,87 +269,98 @@ Keep the essence and character of the original image while applying these transf
 
 
 async def generate_lp_cover(
-    mood_data: dict,
     analysis: str,
     session_id: str,
     output_dir: Path,
-    image_path: Optional[str] = None
+    image_part: Optional[types.Part] = None
 ) -> Optional[str]:
     """
     LP 스타일 커버 이미지 생성 (1:1 비율)
 
     Args:
-        mood_data: Gemini 무드 분석 결과
         analysis: 이미지 분석 텍스트
         session_id: 세션 ID
         output_dir: 출력 디렉토리
-        image_path: 입력 이미지 경로 (선택사항)
+        image_part: 입력 이미지 Part (선택사항)
 
     Returns:
         생성된 이미지 파일 경로 (실패시 None)
     """
     try:
-        client = get_genai_client()
-        keywords = extract_mood_keywords(mood_data)
-
-        prompt = f"""[일러스트,앨범커버 변환 프롬프트] 
-프롬프트:
-제공된 사진을 바탕으로 따뜻하고 포근한 손그림 회화 스타일의 일러스트를 제작하고, 이를 상세한 바이닐(LP) 앨범 커버 목업에 적용해줘. 전체 이미지 비율은 16:9 와이드스크린이며, 배경은 완전한 순백색이다.
+        output_path = output_dir / f"{session_id}_lp.png"
+        key = _request_key(image_part, "lp")
+        cache_path = _cache_path(output_dir, key, "lp")
 
-1. 일러스트레이션 스타일:
+        # 같은 입력 이미지로 생성한 결과가 캐시에 있으면 재사용
+        if cache_path is not None and cache_path.exists():
+            await asyncio.to_thread(use_cached, cache_path, output_path)
+            print(f"[ImageGen] LP cover cache hit: {output_path}")
+            return str(output_path)
 
-원본 사진의 구도와 피사체는 완벽하게 유지하되, 사진적인 질감은 완전히 제거한다.
-붓 자국이 선명하게 느껴지는 두터운 유화 또는 아크릴 페인팅 질감으로 표현한다.
-세부 디테일은 과감하게 단순화하고, 전체적인 형태와 따뜻한 분위기 위주로 묘사한다. 전체적인 사진의 밝기는  유지하고 사진의 색깔도 그대로 사용하되 부드럽고 온화하게 섞인 페인터리 톤(그림책이나 손그림 애니메이션 배경 느낌)으로 바꾼다. (지브리 스타일 모방 금지)
+        # 이미지와 프롬프트를 함께 전달
+        if image_part is not None:
+            contents = [image_part, _LP_PROMPT]
+            print(f"[ImageGen] LP cover: Using input image")
+        else:
+            contents = _LP_PROMPT
+            print(f"[ImageGen] LP cover: No input image, generating from prompt only")
 
-2. 상세 목업 구성 (핵심):
+        images = await _generate_image_data(contents, key)
+        if not images:
+            print(f"[ImageGen] No image data in response for LP cover")
+            return None
 
-화면 중앙에 **정사각형의 바이닐 레코드 슬리브(커버)**가 위치한다. 슬리브는 약간 거친 무광 질감의 두꺼운 종이 재질로 표현되어야 한다.
-이 슬리브의 앞면 전체에 위에서 제작한 회화 일러스트가 인쇄되어 있다.
-슬리브의 오른쪽 측면 입구로 **검은색 바이닐 레코드(LP판)**가 미끄러져 나오고 있다.
-레코드는 전체의 약 3분의 1(1/3) 정도만 슬리브 밖으로 노출되어 있어야 한다.
-노출된 레코드 표면에는 동심원의 소리 골(groove) 디테일이 보여야 하며, 레코드 중앙에는 원형 종이 라벨이 붙어 있다.
-이 중앙 원형 라벨에도 커버와 동일한 일러스트가 작게 크롭되어 들어가야 한다.
-3. 레이아웃 및 배경:
+        _write_atomic(output_path, images[0])
+        await asyncio.to_thread(_store_in_cache, output_path, cache_path)
+        print(f"[ImageGen] LP cover saved: {output_path}")
+        return str(output_path)
 
-이 모든 목업 구성 요소(슬리브와 빠져나온 레코드)는 아무런 무늬나 그림자가 없는 깨끗한 순백색(#FFFFFF) 배경 정중앙에 배치된다.
-부드럽고 자연스러운 스튜디오 조명을 사용하여 입체감을 준다."""
+    except Exception as e:
+        print(f"[ImageGen] LP cover generation failed: {str(e)}")
+        return None
 
-        # 이미지와 프롬프트를 함께 전달
-        if image_path and Path(image_path).exists():
-            image_part = load_image_as_part(image_path)
-            contents = [image_part, prompt]
-            print(f"[ImageGen] LP cover: Using input image {image_path}")
-        else:
-            contents = prompt
-            print(f"[ImageGen] LP cover: No input image, generating from prompt only")
 
-        response = await asyncio.to_thread(
-            client.models.generate_content,
-            model="gemini-3-pro-image-preview",
-            contents=contents,
-            config=types.GenerateContentConfig(
-                response_modalities=['IMAGE']
-            )
-        )
+async def generate_fused_images(
+    session_id: str,
+    output_dir: Path,
+    image_part: Optional[types.Part] = None
+) -> Optional[tuple[str, str]]:
+    """
+    YouTube 썸네일과 LP 커버를 한 번의 요청으로 생성
 
-        # 이미지 추출 및 저장
-        output_path = output_dir / f"{session_id}_lp.png"
+    입력 이미지 업로드와 프롬프트 처리를 한 번만 하도록 두 결과물을 함께 요청합니다.
 
-        for part in response.candidates[0].content.parts:
-            if part.inline_data is not None:
-                image = part.inline_data
-                # 이미지 데이터를 파일로 저장
-                with open(output_path, "wb") as f:
-                    f.write(image.data)
-                print(f"[ImageGen] LP cover saved: {output_path}")
-                return str(output_path)
+    Returns:
+        (썸네일 경로, LP 커버 경로), 두 이미지를 모두 받지 못하면 None (개별 요청으로 대체)
+    """
+    if image_part is None:
+        return None
 
-        print(f"[ImageGen] No image data in response for LP cover")
+    youtube_cache = _cache_path(output_dir, _request_key(image_part, "yt"), "yt")
+    lp_cache = _cache_path(output_dir, _request_key(image_part, "lp"), "lp")
+    if youtube_cache.exists() or lp_cache.exists():
+        # 캐시된 이미지는 개별 생성 경로에서 바로 재사용
         return None
 
+    try:
+        images = await _generate_image_data(
+            [image_part, _FUSED_PROMPT], _request_key(image_part, "fused")
+        )
+        if len(images) < 2:
+            print(f"[ImageGen] Fused request returned {len(images)} image(s), falling back to separate requests")
+            return None
+
+        youtube_path = output_dir / f"{session_id}_youtube.png"
+        lp_path = output_dir / f"{session_id}_lp.png"
+        _write_atomic(youtube_path, images[0])
+        _write_atomic(lp_path, images[1])
+        await asyncio.to_thread(_store_in_cache, youtube_path, youtube_cache)
+        await asyncio.to_thread(_store_in_cache, lp_path, lp_cache)
+        print(f"[ImageGen] Fused images saved: {youtube_path}, {lp_path}")
+        return str(youtube_path), str(lp_path)
+
     except Exception as e:
-        print(f"[ImageGen] LP cover generation failed: {str(e)}")
+        print(f"[ImageGen] Fused image generation failed: {str(e)}")
         return None
 
 
@@ -212,7 +372,7 @@ async def generate_playlist_images(
     image_path: Optional[str] = None
 ) -> dict:
     """
-    YouTube 썸네일과 LP 커버를 동시에 생성
+    YouTube 썸네일과 LP 커버 생성
 
     Args:
         mood_data: Gemini 무드 분석 결과
@@ -225,14 +385,22 @@ async def generate_playlist_images(
         {"youtube": path_or_none, "lp": path_or_none}
     """
     print(f"[{session_id}] Starting image generation...")
-    if image_path:
+
+    # 입력 이미지는 한 번만 읽어서 두 생성 작업에 공유
+    image_part = None
+    if image_path and Path(image_path).exists():
         print(f"[{session_id}] Input image: {image_path}")
+        image_part = await asyncio.to_thread(load_image_as_part, image_path)
 
-    # 두 이미지를 병렬로 생성
-    youtube_task = generate_youtube_thumbnail(mood_data, analysis, session_id, output_dir, image_path)
-    lp_task = generate_lp_cover(mood_data, analysis, session_id, output_dir, image_path)
+    # 한 번의 요청으로 두 이미지 생성, 실패하면 두 이미지를 병렬로 개별 생성
+    fused = await generate_fused_images(session_id, output_dir, image_part)
+    if fused is not None:
+        youtube_path, lp_path = fused
+    else:
+        youtube_task = generate_youtube_thumbnail(analysis, session_id, output_dir, image_part)
+        lp_task = generate_lp_cover(analysis, session_id, output_dir, image_part)
 
-    youtube_path, lp_path = await asyncio.gather(youtube_task, lp_task)
+        youtube_path, lp_path = await asyncio.gather(youtube_task, lp_task)
 
     result = {
         "youtube": youtube_path,
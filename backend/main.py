@@ -1,35 +1,58 @@
 import os
-import json
 import uuid
 import asyncio
+import functools
+import hashlib
+import logging
+import queue
 import re
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 import google.generativeai as genai
+import imagehash
+import orjson
 import requests
 import yt_dlp
 from PIL import Image
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, ORJSONResponse
 from pydub import AudioSegment
 from dotenv import load_dotenv
+from typing_extensions import TypedDict
 
 # Cookie manager for YouTube
-from cookie_manager import setup_browser_profile, refresh_cookies_if_needed
+from cookie_manager import fetch_youtube_cookies, get_cookie_file, refresh_cookies_if_needed, shutdown_browser_pool
 
 # Image generator
 from image_generator import generate_playlist_images
 
+# Disk cache helpers (shared with image_generator)
+from file_cache import link_or_copy, prune_cache, use_cached
+
 # Load environment variables
 load_dotenv()
 
+# 로그 레벨은 LOG_LEVEL 환경변수로 조정 (Gemini 원본 응답 등은 DEBUG에서만 출력)
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+logger = logging.getLogger(__name__)
+
 # Initialize FastAPI
 app = FastAPI(
     title="AI Music Curator",
     description="이미지 기반 감성 분석 및 AI 음악 큐레이션 서비스",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -41,6 +64,21 @@ app.add_middleware(
     expose_headers=["X-Youtube-URLs", "X-Successful-URLs", "X-Failed-URLs", "X-Songs", "X-Emotions", "X-Reason"],
 )
 
+
+class JSONGZipMiddleware(GZipMiddleware):
+    """
+    JSON 응답만 gzip 압축 (/download/* 의 MP3·PNG는 이미 압축된 포맷이라 제외)
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/download"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+app.add_middleware(JSONGZipMiddleware, minimum_size=1024)
+
 # Configure API Keys
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
@@ -49,26 +87,448 @@ if not GEMINI_API_KEY:
 
 genai.configure(api_key=GEMINI_API_KEY)
 
+# Gemini 응답 JSON 스키마 (JSON 모드로 항상 유효한 JSON을 받기 위해 사용)
+class MoodItem(TypedDict):
+    selected: str
+    intensity: int
+
+
+class Mood(TypedDict):
+    energy: MoodItem
+    tempo: MoodItem
+    temperature: MoodItem
+    brightness: MoodItem
+    atmosphere: MoodItem
+    density: MoodItem
+
+
+class Song(TypedDict):
+    title: str
+    artist: str
+    reason: str
+
+
+class PlaylistResponse(TypedDict):
+    mood: Mood
+    analysis: str
+    playlist_title: str
+    reason: str
+    songs: List[Song]
+
+
+class SongsResponse(TypedDict):
+    playlist_title: str
+    reason: str
+    songs: List[Song]
+
+
+# 요청마다 생성하지 않도록 모듈 로드 시 한 번만 만들어 재사용
+GEMINI_MODEL = genai.GenerativeModel(
+    'gemini-3-pro-preview',
+    generation_config={
+        'response_mime_type': 'application/json',
+        'response_schema': PlaylistResponse,
+    }
+)
+
+# 캐시된 무드 분석으로 곡만 다시 추천받을 때 사용 (이미지 없이 텍스트로만 요청)
+GEMINI_SONGS_MODEL = genai.GenerativeModel(
+    'gemini-3-pro-preview',
+    generation_config={
+        'response_mime_type': 'application/json',
+        'response_schema': SongsResponse,
+    }
+)
+
+
 # Create temp directory
 TEMP_DIR = Path("temp")
 TEMP_DIR.mkdir(exist_ok=True)
 
+# 곡 캐시: (제목, 가수) -> YouTube video_id, 오디오는 audio_cache/{video_id}.mp3에 보관
+AUDIO_CACHE_DIR = TEMP_DIR / "audio_cache"
+AUDIO_CACHE_DIR.mkdir(exist_ok=True)
+SONG_CACHE_MAX = 500
+# 디스크 캐시 한도 (재시작 전에 받아 둔 파일까지 포함, 오래 사용되지 않은 것부터 삭제)
+AUDIO_CACHE_MAX_FILES = SONG_CACHE_MAX
+AUDIO_CACHE_MAX_BYTES = 2 * 1024 ** 3
+SONG_CACHE: "OrderedDict[tuple[str, str], str]" = OrderedDict()
+
+# 무드 분석 캐시: 이미지 perceptual hash(hex) -> (ImageHash, {"mood", "analysis"})
+# 해밍 거리가 MOOD_HASH_DISTANCE 미만이면 같은(비슷한) 이미지로 보고 무드 분석만 재사용
+# (곡 추천은 매번 새로 받아서 플레이리스트 재생성 시 다른 곡이 나오도록 함)
+MOOD_CACHE_MAX = 256
+MOOD_HASH_DISTANCE = 5
+MOOD_CACHE: "OrderedDict[str, tuple[imagehash.ImageHash, dict]]" = OrderedDict()
+
+# 세션 -> 진행 중인 이미지 생성 작업 (응답 후에도 계속 실행, 완료되면 제거)
+IMAGE_JOBS: dict[str, asyncio.Task] = {}
+IMAGE_JOB_TIMEOUT = 120
+
+# 세션 -> 이미지별 생성 결과 ("ready" / "failed"), 진행 중인 세션은 IMAGE_JOBS에만 있음
+IMAGE_STATUS_MAX = 1000
+IMAGE_STATUS: "OrderedDict[str, dict[str, str]]" = OrderedDict()
+IMAGE_TYPES = ("youtube", "lp")
+
+# 세션 -> 병합 플레이리스트 해시 (같은 곡 조합이면 병합 파일을 공유)
+PLAYLIST_SESSIONS: dict[str, str] = {}
+
+# 동시에 처리하는 플레이리스트 파이프라인 수 제한 (부하 시 스레드/메모리 고갈 방지)
+PIPELINE_SEM = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT", "4")))
+
+# yt-dlp/ffmpeg/pydub 같은 블로킹 작업 전용 스레드 풀 (Gemini 호출과 기본 풀을 나눠 씀)
+IO_POOL = ThreadPoolExecutor(max_workers=16, thread_name_prefix="io")
+
+# 모든 곡을 같은 포맷(44.1kHz 스테레오 192kbps MP3)으로 맞춰야 병합 시 재인코딩 없이 이어 붙일 수 있음
+MP3_SAMPLE_RATE = 44100
+MP3_CHANNELS = 2
+MP3_FORMAT_ARGS = ['-ar', str(MP3_SAMPLE_RATE), '-ac', str(MP3_CHANNELS)]
+MP3_ENCODE_ARGS = ['-c:a', 'libmp3lame', '-b:a', '192k', *MP3_FORMAT_ARGS]
+
+# 오디오 스트림 직접 다운로드 재시도 횟수 (실패 시 yt-dlp 다운로더로 대체)
+AUDIO_DOWNLOAD_RETRIES = 3
+
+# 오디오 스트림 직접 다운로드용 공용 세션 (keep-alive로 곡/요청 간 TLS 핸드셰이크 재사용)
+HTTP_SESSION = requests.Session()
+_http_adapter = requests.adapters.HTTPAdapter(pool_connections=32, pool_maxsize=64)
+HTTP_SESSION.mount('https://', _http_adapter)
+HTTP_SESSION.mount('http://', _http_adapter)
+
+# 미리 만들어 재사용할 YoutubeDL 인스턴스 수
+YDL_POOL_SIZE = 4
+
+
+def get_ydl_opts(output_path: Optional[str] = None) -> dict:
+    opts = {
+        'format': 'ba/b/best',
+        'quiet': False,
+        'no_warnings': False,
+        'ignoreerrors': False,
+        'nocheckcertificate': True,
+        'extract_flat': False,
+        'ffmpeg_location': '/usr/bin/ffmpeg',
+        'socket_timeout': 60,
+        'retries': 3,
+        'fragment_retries': 3,
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'en-us,en;q=0.5',
+            'Sec-Fetch-Mode': 'navigate',
+        },
+    }
+    if output_path:
+        opts['outtmpl'] = output_path
+    cookie_file = get_cookie_file()
+    if cookie_file:
+        opts['cookiefile'] = str(cookie_file)
+    return opts
+
+
+def close_ydl(ydl: yt_dlp.YoutubeDL):
+    """
+    YoutubeDL 종료 (쿠키 파일은 덮어쓰지 않음)
+
+    close()는 메모리의 cookiejar를 cookiefile에 다시 저장하므로,
+    그대로 닫으면 갱신된 쿠키 파일을 예전 쿠키로 되돌릴 수 있음
+    """
+    ydl.params['cookiefile'] = None
+    try:
+        ydl.close()
+    except Exception:
+        pass
+
+
+class YoutubeDLPool:
+    """
+    검색/포맷 추출용 YoutubeDL 인스턴스를 재사용하는 풀
+
+    YoutubeDL 생성 시 추출기 로딩과 쿠키 파일 읽기가 매번 반복되므로,
+    미리 만들어 둔 인스턴스를 스레드마다 하나씩 빌려 씁니다.
+    (YoutubeDL은 내부 상태가 있어 여러 스레드가 한 인스턴스를 동시에 쓰지 않도록 함)
+
+    acquire()는 (generation, ydl)을 반환하고, release/discard에 그대로 돌려줍니다.
+    """
+
+    def __init__(self, size=YDL_POOL_SIZE):
+        self._size = size
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+
+    def _create(self):
+        return self._generation, yt_dlp.YoutubeDL(get_ydl_opts())
+
+    def warm_up(self):
+        """size개까지 미리 생성"""
+        while self._idle.qsize() < self._size:
+            self._idle.put(self._create())
+
+    def acquire(self):
+        """유휴 인스턴스 반환, 없으면 새로 생성"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._create()
+
+    def release(self, item):
+        """사용이 끝난 인스턴스를 풀에 반환 (쿠키 갱신 이전 인스턴스는 폐기)"""
+        generation, _ = item
+        with self._lock:
+            if generation == self._generation and self._idle.qsize() < self._size:
+                self._idle.put(item)
+                return
+        self.discard(item)
+
+    def discard(self, item):
+        close_ydl(item[1])
+
+    def reset(self):
+        """쿠키 갱신 후 호출: 기존 인스턴스를 모두 폐기하고 다시 생성"""
+        with self._lock:
+            self._generation += 1
+        self.shutdown()
+        self.warm_up()
+
+    def shutdown(self):
+        """풀의 모든 인스턴스 정리"""
+        while True:
+            try:
+                item = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(item)
+
+
+app.state.ydl_pool = YoutubeDLPool()
+
 
 # Startup event - 서버 시작 시 브라우저 프로필 설정
 @app.on_event("startup")
 async def startup_event():
-    print("[Startup] Setting up browser profile for YouTube...")
+    logger.info("[Startup] Setting up browser profile for YouTube...")
     try:
-        success = await asyncio.to_thread(setup_browser_profile)
+        success = await asyncio.to_thread(fetch_youtube_cookies)
         if success:
-            print("[Startup] Browser profile setup complete - logged in")
+            logger.info("[Startup] Browser profile setup complete - logged in")
         else:
-            print("[Startup] Browser profile setup complete - login failed or skipped")
+            logger.warning("[Startup] Browser profile setup complete - login failed or skipped")
     except Exception as e:
-        print(f"[Startup] Browser profile setup failed: {str(e)}")
+        logger.error("[Startup] Browser profile setup failed: %s", e)
+
+    # 쿠키가 준비된 뒤 YoutubeDL 인스턴스를 미리 생성
+    await run_io(app.state.ydl_pool.warm_up)
+
+    # 이전 실행에서 남은 오디오 캐시 파일 정리
+    await run_io(prune_audio_cache)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await asyncio.to_thread(shutdown_browser_pool)
+    app.state.ydl_pool.shutdown()
+    HTTP_SESSION.close()
+    IO_POOL.shutdown(wait=False, cancel_futures=True)
+
+
+# parse_gemini_json에서 사용하는 정규식 (모듈 로드 시 한 번만 컴파일)
+_CTRL_RE = re.compile(r'[\x00-\x1f\x7f]')
+_WS_RE = re.compile(r'\s+')
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+_INNER_QUOTE_RE = re.compile(r':\s*"([^"]*?)\'([^"]*?)"')
+_QUOTED_RE = re.compile(r'"([^"]+)"')
+# 수동 추출용: 한 번의 스캔으로 emotions / analysis / playlist_title / reason / songs 를 모두 찾음
+_FALLBACK_RE = re.compile(
+    r'"emotions"\s*:\s*\[(?P<emotions>[^\]]*)\]'
+    r'|"analysis"\s*:\s*"(?P<analysis>[^"]*)"'
+    r'|"playlist_title"\s*:\s*"(?P<title>[^"]*)"'
+    r'|"reason"\s*:\s*"(?P<reason>[^"]*)"'
+    r'|"songs"\s*:\s*\[(?P<songs>.*?)\]',
+    re.DOTALL
+)
+_MOOD_ITEM_RE = re.compile(
+    r'"(?P<key>energy|tempo|temperature|brightness|atmosphere|density)"\s*:\s*\{\s*'
+    r'"selected"\s*:\s*"(?P<selected>[^"]*)"\s*,\s*"intensity"\s*:\s*(?P<intensity>\d+)'
+)
+_SONG_WITH_REASON_RE = re.compile(r'\{\s*"title"\s*:\s*"([^"]*)"\s*,\s*"artist"\s*:\s*"([^"]*)"\s*,\s*"reason"\s*:\s*"([^"]*)"\s*\}')
+_SONG_RE = re.compile(r'\{\s*"title"\s*:\s*"([^"]*)"\s*,\s*"artist"\s*:\s*"([^"]*)"\s*\}')
 
 
 # Helper Functions
+def is_complete_playlist_data(data: dict) -> bool:
+    """
+    mood 6개 항목(selected/intensity), analysis, songs가 모두 있는지 확인
+    (수동 추출 등으로 일부만 파싱된 응답은 프론트엔드에서 사용할 수 없음)
+    """
+    mood = data.get("mood")
+    if not isinstance(mood, dict):
+        return False
+    for key in Mood.__annotations__:
+        item = mood.get(key)
+        if not isinstance(item, dict) or "selected" not in item or "intensity" not in item:
+            return False
+    return bool(data.get("analysis")) and bool(data.get("songs"))
+
+
+def song_cache_key(title: str, artist: str) -> tuple[str, str]:
+    return (title.lower().strip(), artist.lower().strip())
+
+
+def cached_audio_path(video_id: str) -> Path:
+    return AUDIO_CACHE_DIR / f"{video_id}.mp3"
+
+
+def remember_song(key: tuple[str, str], video_id: str):
+    """곡 캐시에 기록하고 LRU 순서로 최대 SONG_CACHE_MAX개까지만 유지"""
+    SONG_CACHE[key] = video_id
+    SONG_CACHE.move_to_end(key)
+    while len(SONG_CACHE) > SONG_CACHE_MAX:
+        _, evicted_id = SONG_CACHE.popitem(last=False)
+        # 같은 영상을 가리키는 다른 키가 남아 있으면 파일 유지
+        if evicted_id not in SONG_CACHE.values():
+            cached_audio_path(evicted_id).unlink(missing_ok=True)
+
+
+def prune_audio_cache():
+    """
+    AUDIO_CACHE_DIR을 mtime 기준 LRU로 정리 (개수/용량 한도 초과분 삭제)
+
+    SONG_CACHE 인덱스는 메모리에만 있으므로, 재시작 전에 받아 둔 파일도
+    여기서 함께 관리해야 디스크 사용량이 계속 늘지 않음
+    """
+    prune_cache(AUDIO_CACHE_DIR, ".mp3", AUDIO_CACHE_MAX_FILES, AUDIO_CACHE_MAX_BYTES)
+
+
+def image_phash(image_bytes: bytes) -> Optional[imagehash.ImageHash]:
+    """업로드 이미지의 perceptual hash (이미지로 열 수 없으면 None)"""
+    try:
+        with Image.open(BytesIO(image_bytes)) as img:
+            return imagehash.phash(img)
+    except Exception:
+        return None
+
+
+def lookup_mood_cache(phash: Optional[imagehash.ImageHash]) -> Optional[dict]:
+    if phash is None:
+        return None
+
+    key = str(phash)
+    if key in MOOD_CACHE:
+        MOOD_CACHE.move_to_end(key)
+        return MOOD_CACHE[key][1]
+
+    for key, (cached_hash, data) in MOOD_CACHE.items():
+        if cached_hash - phash < MOOD_HASH_DISTANCE:
+            MOOD_CACHE.move_to_end(key)
+            return data
+    return None
+
+
+def remember_mood(phash: Optional[imagehash.ImageHash], data: dict):
+    """
+    Gemini 결과 중 mood/analysis만 캐시에 기록하고 LRU 순서로 최대 MOOD_CACHE_MAX개까지만 유지
+    (mood/analysis가 빠진 불완전한 결과는 비슷한 이미지에 계속 재사용되지 않도록 저장하지 않음)
+    """
+    if phash is None or not is_complete_playlist_data(data):
+        return
+    key = str(phash)
+    MOOD_CACHE[key] = (phash, {"mood": data["mood"], "analysis": data["analysis"]})
+    MOOD_CACHE.move_to_end(key)
+    while len(MOOD_CACHE) > MOOD_CACHE_MAX:
+        MOOD_CACHE.popitem(last=False)
+
+
+def image_output_path(session_id: str, image_type: str) -> Path:
+    return TEMP_DIR / f"{session_id}_{image_type}.png"
+
+
+def track_image_job(session_id: str, task: asyncio.Task, image_path: str):
+    """
+    이미지 생성 작업을 응답과 분리해서 실행하고, 끝나면 결과를 IMAGE_STATUS에 기록
+
+    입력 이미지(image_path)는 작업이 끝난 뒤 여기서 삭제하고,
+    작업이 취소되면(파이프라인 실패) 이미 만들어진 세션 이미지도 함께 삭제
+    """
+    IMAGE_JOBS[session_id] = task
+
+    def on_done(t: asyncio.Task):
+        IMAGE_JOBS.pop(session_id, None)
+        cleanup = [image_path]
+
+        if t.cancelled():
+            cleanup += [str(image_output_path(session_id, image_type)) for image_type in IMAGE_TYPES]
+            status = {image_type: "failed" for image_type in IMAGE_TYPES}
+        elif t.exception():
+            logger.warning("[%s] Image generation failed: %s", session_id, t.exception())
+            status = {image_type: "failed" for image_type in IMAGE_TYPES}
+        else:
+            result = t.result() or {}
+            status = {
+                image_type: "ready" if result.get(image_type) else "failed"
+                for image_type in IMAGE_TYPES
+            }
+
+        IMAGE_STATUS[session_id] = status
+        while len(IMAGE_STATUS) > IMAGE_STATUS_MAX:
+            IMAGE_STATUS.popitem(last=False)
+
+        # 참조를 남기지 않는 Task는 실행 전에 GC될 수 있으므로 IO_POOL에 바로 넘김 (executor가 작업을 보관)
+        run_io(cleanup_files, cleanup)
+
+    task.add_done_callback(on_done)
+
+
+def get_image_status(session_id: str, image_type: str) -> str:
+    """이미지 상태: "pending" / "ready" / "failed" / "unknown" (만료되었거나 없는 세션)"""
+    if session_id in IMAGE_JOBS:
+        return "pending"
+    status = IMAGE_STATUS.get(session_id)
+    if status is not None:
+        return status[image_type]
+    if image_output_path(session_id, image_type).exists():
+        return "ready"
+    return "unknown"
+
+
+def cancel_image_job(session_id: str):
+    """파이프라인 실패 시 진행 중인 이미지 생성 작업 취소 (정리는 on_done에서)"""
+    job = IMAGE_JOBS.get(session_id)
+    if job is not None:
+        job.cancel()
+
+
+def playlist_hash_for(video_ids: List[str]) -> str:
+    return hashlib.blake2b("|".join(video_ids).encode(), digest_size=16).hexdigest()
+
+
+def playlist_path(playlist_hash: str) -> Path:
+    return TEMP_DIR / f"playlist_{playlist_hash}.mp3"
+
+
+async def release_playlist(session_id: str):
+    """세션의 플레이리스트 참조를 해제하고, 다른 세션이 쓰지 않으면 파일 삭제"""
+    playlist_hash = PLAYLIST_SESSIONS.pop(session_id, None)
+    if playlist_hash and playlist_hash not in PLAYLIST_SESSIONS.values():
+        await cleanup_files_async([str(playlist_path(playlist_hash))])
+
+
+def run_io(func, *args, **kwargs):
+    """블로킹 함수를 IO_POOL에서 실행"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(IO_POOL, functools.partial(func, *args, **kwargs))
+
+
+def load_gemini_json(gemini_response: str, session_id: str = "") -> dict:
+    """
+    JSON 모드 Gemini 응답 파싱 (orjson), 실패할 때만 parse_gemini_json으로 정리 후 재시도
+    """
+    try:
+        return orjson.loads(gemini_response)
+    except orjson.JSONDecodeError:
+        logger.warning("[%s] Strict JSON parse failed, falling back to cleanup parser", session_id)
+        return parse_gemini_json(gemini_response, session_id)
+
+
 def parse_gemini_json(gemini_response: str, session_id: str = "") -> dict:
     """
     Gemini 응답에서 JSON을 안전하게 파싱
@@ -98,11 +558,11 @@ def parse_gemini_json(gemini_response: str, session_id: str = "") -> dict:
         # Attempt 1: Basic cleanup
         lambda s: s,
         # Attempt 2: Remove control characters and normalize whitespace
-        lambda s: re.sub(r'\s+', ' ', re.sub(r'[\x00-\x1f\x7f]', ' ', s)),
+        lambda s: _WS_RE.sub(' ', _CTRL_RE.sub(' ', s)),
         # Attempt 3: Remove trailing commas
-        lambda s: re.sub(r',(\s*[}\]])', r'\1', s),
+        lambda s: _TRAILING_COMMA_RE.sub(r'\1', s),
         # Attempt 4: Fix unescaped quotes in string values
-        lambda s: re.sub(r':\s*"([^"]*?)\'([^"]*?)"', r': "\1\2"', s),
+        lambda s: _INNER_QUOTE_RE.sub(r': "\1\2"', s),
         # Attempt 5: Replace single quotes with double quotes (careful approach)
         lambda s: s.replace("'", '"') if "'" in s and s.count('"') < 10 else s,
     ]
@@ -113,74 +573,83 @@ def parse_gemini_json(gemini_response: str, session_id: str = "") -> dict:
     for i, cleanup in enumerate(cleanup_attempts):
         try:
             current_str = cleanup(current_str)
-            result = json.loads(current_str)
-            print(f"[{session_id}] JSON parsed successfully on attempt {i + 1}")
+            result = orjson.loads(current_str)
+            logger.info("[%s] JSON parsed successfully on attempt %s", session_id, i + 1)
             return result
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             last_error = e
             continue
 
     # Final attempt: Extract data manually using regex
-    print(f"[{session_id}] Attempting manual regex extraction...")
+    logger.warning("[%s] Attempting manual regex extraction...", session_id)
     try:
         emotions = []
         playlist_title = ""
         reason = ""
         songs = []
 
-        # Extract emotions
-        emotions_match = re.search(r'"emotions"\s*:\s*\[([^\]]*)\]', json_str)
-        if emotions_match:
-            emotions_str = emotions_match.group(1)
-            emotions = re.findall(r'"([^"]+)"', emotions_str)
-
-        # Extract playlist_title
-        title_match = re.search(r'"playlist_title"\s*:\s*"([^"]*)"', json_str)
-        if title_match:
-            playlist_title = title_match.group(1)
+        # 필드별로 처음 나온 값만 사용 (songs 배열 안의 reason은 songs 매치에 포함되어 건너뜀)
+        fields = {}
+        for match in _FALLBACK_RE.finditer(json_str):
+            fields.setdefault(match.lastgroup, match.group(match.lastgroup))
 
-        # Extract reason
-        reason_match = re.search(r'"reason"\s*:\s*"([^"]*(?:[^"\\]|\\.)*)"|"reason"\s*:\s*"([^"]*)"', json_str)
-        if reason_match:
-            reason = reason_match.group(1) or reason_match.group(2) or ""
+        # Extract emotions
+        if "emotions" in fields:
+            emotions = _QUOTED_RE.findall(fields["emotions"])
+
+        # Extract mood
+        mood = {}
+        for match in _MOOD_ITEM_RE.finditer(json_str):
+            mood.setdefault(match.group("key"), {
+                "selected": match.group("selected"),
+                "intensity": int(match.group("intensity")),
+            })
+
+        # Extract analysis / playlist_title / reason
+        analysis = fields.get("analysis", "")
+        playlist_title = fields.get("title", "")
+        reason = fields.get("reason", "")
 
         # Extract songs
-        songs_match = re.search(r'"songs"\s*:\s*\[(.*?)\]', json_str, re.DOTALL)
-        if songs_match:
-            songs_str = songs_match.group(1)
+        if "songs" in fields:
+            songs_str = fields["songs"]
             # Try pattern with reason first
-            song_pattern_with_reason = r'\{\s*"title"\s*:\s*"([^"]*)"\s*,\s*"artist"\s*:\s*"([^"]*)"\s*,\s*"reason"\s*:\s*"([^"]*)"\s*\}'
-            matches = list(re.finditer(song_pattern_with_reason, songs_str))
+            matches = list(_SONG_WITH_REASON_RE.finditer(songs_str))
             if matches:
                 for match in matches:
                     songs.append({"title": match.group(1), "artist": match.group(2), "reason": match.group(3)})
             else:
                 # Fallback to pattern without reason
-                song_pattern = r'\{\s*"title"\s*:\s*"([^"]*)"\s*,\s*"artist"\s*:\s*"([^"]*)"\s*\}'
-                for match in re.finditer(song_pattern, songs_str):
+                for match in _SONG_RE.finditer(songs_str):
                     songs.append({"title": match.group(1), "artist": match.group(2), "reason": ""})
 
         if songs:
-            print(f"[{session_id}] Manual extraction succeeded: {len(songs)} songs found")
-            return {"emotions": emotions, "playlist_title": playlist_title, "reason": reason, "songs": songs}
+            logger.info("[%s] Manual extraction succeeded: %s songs found", session_id, len(songs))
+            return {
+                "mood": mood,
+                "analysis": analysis,
+                "emotions": emotions,
+                "playlist_title": playlist_title,
+                "reason": reason,
+                "songs": songs,
+            }
     except Exception as e:
-        print(f"[{session_id}] Manual extraction failed: {str(e)}")
+        logger.warning("[%s] Manual extraction failed: %s", session_id, e)
 
     raise last_error or ValueError("Failed to parse JSON after all attempts")
 
 
-async def analyze_mood_with_gemini(image_path: str) -> dict:
+async def analyze_and_recommend_with_gemini(image_bytes: bytes, mime_type: str) -> str:
     """
-    Gemini를 사용하여 이미지의 음악적 감성 수치 분석 (1단계)
+    Gemini를 사용하여 이미지의 음악적 감성 수치 분석과 곡 추천을 한 번에 수행
     """
     try:
-        model = genai.GenerativeModel('gemini-3-pro-preview')
-
         prompt = """[Role]
-당신은 이미지를 음악적 감성 수치로 변환하는 '비주얼-뮤직 매퍼(Visual-Music Mapper)'입니다.
+당신은 이미지를 음악적 감성 수치로 변환하는 '비주얼-뮤직 매퍼(Visual-Music Mapper)'이자, 그 감성 데이터를 기반으로 완벽한 플레이리스트를 추천하는 '뮤직 큐레이터'입니다.
 
 [Task]
-업로드된 이미지를 보고 아래 6가지 카테고리에 대해 가장 두드러지는 특성을 하나씩 선택하고, 그 강도를 0%에서 100% 사이의 수치로 제시하세요.
+1. 업로드된 이미지를 보고 아래 6가지 카테고리에 대해 가장 두드러지는 특성을 하나씩 선택하고, 그 강도를 0%에서 100% 사이의 수치로 제시하세요.
+2. 1번의 감성 분석 결과를 바탕으로 어울리는 곡 3개를 추천하고, 플레이리스트의 제목을 지어주세요.
 
 [Category & Criteria]
 - 에너지: 힙함(Trend, Beat) vs 잔잔함(Peaceful, Acoustic)
@@ -192,161 +661,232 @@ async def analyze_mood_with_gemini(image_path: str) -> dict:
 
 [Output Format]
 반드시 아래 JSON 형식으로만 응답하세요:
-{"mood": {"energy": {"selected": "힙함 또는 잔잔함", "intensity": 75}, "tempo": {"selected": "신나는 또는 차분한", "intensity": 60}, "temperature": {"selected": "따뜻한 또는 차가운", "intensity": 80}, "brightness": {"selected": "밝은 또는 어두운", "intensity": 70}, "atmosphere": {"selected": "몽환적인 또는 선명한", "intensity": 65}, "density": {"selected": "미니멀한 또는 풍성한", "intensity": 50}}, "analysis": "사진의 색감, 요소, 구도를 바탕으로 한 줄 분석"}
+{"mood": {"energy": {"selected": "힙함 또는 잔잔함", "intensity": 75}, "tempo": {"selected": "신나는 또는 차분한", "intensity": 60}, "temperature": {"selected": "따뜻한 또는 차가운", "intensity": 80}, "brightness": {"selected": "밝은 또는 어두운", "intensity": 70}, "atmosphere": {"selected": "몽환적인 또는 선명한", "intensity": 65}, "density": {"selected": "미니멀한 또는 풍성한", "intensity": 50}}, "analysis": "사진의 색감, 요소, 구도를 바탕으로 한 줄 분석", "playlist_title": "감성을 담은 창의적인 플레이리스트 제목", "reason": "이 플레이리스트를 추천하는 이유 1-2문장", "songs": [{"title": "노래제목1", "artist": "가수1", "reason": "이 곡을 선정한 이유 1문장"}, {"title": "노래제목2", "artist": "가수2", "reason": "이 곡을 선정한 이유 1문장"}, {"title": "노래제목3", "artist": "가수3", "reason": "이 곡을 선정한 이유 1문장"}]}
 
 규칙:
+- playlist_title은 이미지의 분위기를 반영한 감성적이고 창의적인 제목 (한국어)
+- reason은 한국어로 작성
+- songs는 정확히 3곡
+- 각 곡의 reason은 해당 곡이 이미지 감성에 어울리는 구체적인 이유를 설명
 - 다른 텍스트 없이 JSON만 반환
-- 문자열 내에 따옴표 사용 금지"""
-
-        img = await asyncio.to_thread(Image.open, image_path)
+- 문자열 내에 따옴표 사용 금지
+- 실제 존재하는 곡만 추천"""
 
         response = await asyncio.to_thread(
-            model.generate_content,
-            [prompt, img]
+            GEMINI_MODEL.generate_content,
+            [prompt, {'mime_type': mime_type, 'data': image_bytes}]
         )
 
         return response.text.strip()
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Gemini mood analysis error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Gemini analysis error: {str(e)}")
 
 
 async def recommend_songs_with_gemini(mood_data: dict) -> str:
     """
-    분석된 무드를 기반으로 곡 추천 (2단계)
+    캐시된 무드 분석 결과(mood/analysis)만으로 곡 추천 (이미지 분석 단계 생략)
     """
     try:
-        model = genai.GenerativeModel('gemini-3-pro-preview')
-
-        mood_summary = json.dumps(mood_data, ensure_ascii=False)
-
         prompt = f"""[Role]
 당신은 음악적 감성 데이터를 기반으로 완벽한 플레이리스트를 추천하는 '뮤직 큐레이터'입니다.
 
-[Input - 이미지 분석 결과]
-{mood_summary}
+[Input]
+아래는 사진을 6가지 카테고리(에너지, 템포, 온도, 명도, 분위기, 밀도)로 분석한 감성 수치와 한 줄 분석입니다:
+{orjson.dumps(mood_data).decode()}
 
 [Task]
-위 감성 분석 결과를 바탕으로 어울리는 곡 3개를 추천하고, 플레이리스트의 제목을 지어주세요.
+감성 분석 결과를 바탕으로 어울리는 곡 3개를 추천하고, 플레이리스트의 제목을 지어주세요.
 
 [Output Format]
 반드시 아래 JSON 형식으로만 응답하세요:
 {{"playlist_title": "감성을 담은 창의적인 플레이리스트 제목", "reason": "이 플레이리스트를 추천하는 이유 1-2문장", "songs": [{{"title": "노래제목1", "artist": "가수1", "reason": "이 곡을 선정한 이유 1문장"}}, {{"title": "노래제목2", "artist": "가수2", "reason": "이 곡을 선정한 이유 1문장"}}, {{"title": "노래제목3", "artist": "가수3", "reason": "이 곡을 선정한 이유 1문장"}}]}}
 
 규칙:
-- playlist_title은 이미지의 분위기를 반영한 감성적이고 창의적인 제목 (한국어)
+- playlist_title은 감성 분석 결과를 반영한 감성적이고 창의적인 제목 (한국어)
 - reason은 한국어로 작성
 - songs는 정확히 3곡
-- 각 곡의 reason은 해당 곡이 이미지 감성에 어울리는 구체적인 이유를 설명
+- 각 곡의 reason은 해당 곡이 감성 분석 결과에 어울리는 구체적인 이유를 설명
 - 다른 텍스트 없이 JSON만 반환
 - 문자열 내에 따옴표 사용 금지
 - 실제 존재하는 곡만 추천"""
 
-        response = await asyncio.to_thread(
-            model.generate_content,
-            prompt
-        )
+        response = await asyncio.to_thread(GEMINI_SONGS_MODEL.generate_content, prompt)
 
         return response.text.strip()
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Gemini song recommendation error: {str(e)}")
-
-
-async def download_audio_by_search(title: str, artist: str, output_path: str) -> bool:
-    """
-    yt-dlp를 사용하여 YouTube에서 노래를 검색해서 오디오 다운로드
-    """
-    from cookie_manager import get_cookie_file
-
-    def get_ydl_opts():
-        opts = {
-            'format': 'ba/b/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-            'outtmpl': output_path,
-            'quiet': False,
-            'no_warnings': False,
-            'ignoreerrors': False,
-            'nocheckcertificate': True,
-            'extract_flat': False,
-            'ffmpeg_location': '/usr/bin/ffmpeg',
-            'socket_timeout': 60,
-            'retries': 3,
-            'fragment_retries': 3,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-us,en;q=0.5',
-                'Sec-Fetch-Mode': 'navigate',
-            },
-        }
-        cookie_file = get_cookie_file()
-        if cookie_file:
-            opts['cookiefile'] = str(cookie_file)
-        return opts
+        raise HTTPException(status_code=500, detail=f"Gemini recommendation error: {str(e)}")
 
-    # YouTube 검색 쿼리
-    search_query = f"ytsearch1:{title} {artist} official audio"
 
-    try:
-        print(f"[yt-dlp] Searching: {search_query}")
-        ydl_opts = get_ydl_opts()
-
-        def download_search():
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([search_query])
-
-        await asyncio.to_thread(download_search)
-
-        if os.path.exists(f"{output_path}.mp3"):
-            print(f"[yt-dlp] Download succeeded: {title} by {artist}")
-            return True
-    except Exception as e:
-        print(f"[yt-dlp] Search failed: {str(e)}")
-
-    # 재시도: official 없이
-    search_query_retry = f"ytsearch1:{title} {artist}"
-    try:
-        print(f"[yt-dlp] Retry search: {search_query_retry}")
-        ydl_opts = get_ydl_opts()
+async def download_audio_by_search(title: str, artist: str, output_path: str) -> Optional[str]:
+    """
+    yt-dlp로 YouTube에서 노래를 검색해 오디오 스트림 URL을 얻고,
+    공용 HTTP 세션으로 직접 받아 ffmpeg로 MP3 변환
 
-        def download_retry():
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([search_query_retry])
+    성공하면 video_id를 반환 (캐시에 있으면 검색/다운로드 모두 생략)
+    """
+    output_file = Path(f"{output_path}.mp3")
+    cache_key = song_cache_key(title, artist)
+    cached_id = SONG_CACHE.get(cache_key)
+    if cached_id and cached_audio_path(cached_id).exists():
+        # await 중에 다른 요청의 remember_song이 키를 밀어낼 수 있으므로 먼저 LRU 순서 갱신
+        SONG_CACHE.move_to_end(cache_key)
+        await run_io(use_cached, cached_audio_path(cached_id), output_file)
+        logger.info("[yt-dlp] Cache hit: %s by %s (%s)", title, artist, cached_id)
+        return cached_id
+
+    def resolve_audio(search_query: str) -> dict:
+        # 다운로드 없이 검색 결과의 오디오 포맷 정보만 추출
+        ydl_pool = app.state.ydl_pool
+        item = ydl_pool.acquire()
+        try:
+            info = item[1].extract_info(search_query, download=False)
+        except Exception:
+            ydl_pool.discard(item)
+            raise
+        ydl_pool.release(item)
+        entries = info.get('entries')
+        if entries is not None:
+            if not entries:
+                raise ValueError("No search results")
+            info = entries[0]
+        return info
+
+    def download_with_ydl(info: dict):
+        # yt-dlp 다운로더(재시도/분할 다운로드 포함)로 받아 MP3 변환
+        opts = get_ydl_opts(output_path)
+        opts['postprocessors'] = [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': 'mp3',
+            'preferredquality': '192',
+        }]
+        opts['postprocessor_args'] = {'extractaudio': MP3_FORMAT_ARGS}
+        ydl = yt_dlp.YoutubeDL(opts)
+        try:
+            ydl.process_ie_result(info, download=True)
+        finally:
+            close_ydl(ydl)
+
+    def download_source(info: dict, source_path: str):
+        # 끊기면 받은 위치부터 Range 요청으로 이어받기 (최대 AUDIO_DOWNLOAD_RETRIES회)
+        downloaded = 0
+        for attempt in range(1, AUDIO_DOWNLOAD_RETRIES + 1):
+            headers = dict(info.get('http_headers') or {})
+            if downloaded:
+                headers['Range'] = f"bytes={downloaded}-"
+            try:
+                with HTTP_SESSION.get(info['url'], headers=headers, stream=True, timeout=60) as response:
+                    response.raise_for_status()
+                    if downloaded and response.status_code != 206:
+                        # 서버가 Range를 무시하면 처음부터 다시 받음
+                        downloaded = 0
+                    with open(source_path, "ab" if downloaded else "wb") as f:
+                        for chunk in response.iter_content(chunk_size=1 << 20):
+                            f.write(chunk)
+                            downloaded += len(chunk)
+                return
+            except (requests.RequestException, OSError) as e:
+                if attempt == AUDIO_DOWNLOAD_RETRIES:
+                    raise
+                logger.warning("[yt-dlp] Stream download failed (attempt %s), retrying: %s", attempt, e)
+
+    def fetch_audio(info: dict):
+        if info.get('protocol') not in ('http', 'https'):
+            # HLS/DASH 등 분할 스트림은 yt-dlp 다운로더에 맡김
+            download_with_ydl(info)
+            return
+
+        source_path = f"{output_path}.src.{info.get('ext') or 'audio'}"
+        try:
+            try:
+                download_source(info, source_path)
+            except Exception as e:
+                logger.warning("[yt-dlp] Direct download failed, falling back to yt-dlp downloader: %s", e)
+                download_with_ydl(info)
+                return
+
+            # 원본 코덱과 관계없이 항상 같은 포맷의 MP3로 인코딩 (병합 시 -c copy 가능하도록)
+            subprocess.run(
+                [
+                    '/usr/bin/ffmpeg', '-y', '-loglevel', 'error',
+                    '-i', source_path, '-vn', *MP3_ENCODE_ARGS, f"{output_path}.mp3",
+                ],
+                check=True,
+                capture_output=True,
+            )
+        finally:
+            if os.path.exists(source_path):
+                os.remove(source_path)
+
+    def search_and_fetch(search_query: str) -> str:
+        info = resolve_audio(search_query)
+        video_id = info['id']
+        cached_path = cached_audio_path(video_id)
+        if cached_path.exists():
+            # 다른 제목 표기로 이미 받아 둔 영상이면 다운로드 생략
+            use_cached(cached_path, output_file)
+        else:
+            fetch_audio(info)
+            if output_file.exists():
+                link_or_copy(output_file, cached_path)
+                prune_audio_cache()
+        return video_id
+
+    # YouTube 검색 쿼리 (official audio 우선, 실패 시 official 없이 재시도)
+    attempts = [
+        ("Searching", f"ytsearch1:{title} {artist} official audio"),
+        ("Retry search", f"ytsearch1:{title} {artist}"),
+    ]
 
-        await asyncio.to_thread(download_retry)
+    for label, search_query in attempts:
+        try:
+            logger.info("[yt-dlp] %s: %s", label, search_query)
+            video_id = await run_io(search_and_fetch, search_query)
 
-        if os.path.exists(f"{output_path}.mp3"):
-            print(f"[yt-dlp] Retry succeeded: {title} by {artist}")
-            return True
-    except Exception as e:
-        print(f"[yt-dlp] Retry failed: {str(e)}")
+            if output_file.exists():
+                remember_song(cache_key, video_id)
+                logger.info("[yt-dlp] Download succeeded: %s by %s", title, artist)
+                return video_id
+        except Exception as e:
+            logger.warning("[yt-dlp] %s failed: %s", label, e)
 
-    return False
+    return None
 
 
 async def merge_audio_files(audio_files: List[str], output_path: str) -> str:
     """
-    pydub를 사용하여 여러 오디오 파일을 하나로 병합
+    ffmpeg concat demuxer로 여러 오디오 파일을 디코딩 없이 하나로 병합
+    (ffmpeg 병합 실패 시 pydub로 디코딩 후 재인코딩)
     """
     try:
         if not audio_files:
             raise ValueError("No audio files to merge")
 
-        # Load first audio file
-        combined = await asyncio.to_thread(AudioSegment.from_mp3, audio_files[0])
+        try:
+            await concat_audio_with_ffmpeg(audio_files, output_path)
+            return output_path
+        except Exception as e:
+            logger.warning("[Merge] ffmpeg concat failed, falling back to pydub: %s", e)
 
-        # Append remaining files
-        for audio_file in audio_files[1:]:
-            audio = await asyncio.to_thread(AudioSegment.from_mp3, audio_file)
-            combined += audio
+        # 각 곡 디코딩은 서로 독립적이므로 동시에 실행
+        segments = await asyncio.gather(
+            *(run_io(AudioSegment.from_mp3, audio_file) for audio_file in audio_files)
+        )
+
+        # combined += audio 는 매번 전체 버퍼를 다시 만들기 때문에
+        # 포맷을 첫 곡에 맞춘 뒤 PCM 데이터를 한 번에 이어 붙임
+        first = segments[0]
+        segments = [
+            seg.set_frame_rate(first.frame_rate)
+               .set_channels(first.channels)
+               .set_sample_width(first.sample_width)
+            for seg in segments
+        ]
+        combined = first._spawn(b"".join(seg.raw_data for seg in segments))
 
         # Export merged audio
-        await asyncio.to_thread(
+        await run_io(
             combined.export,
             output_path,
             format="mp3"
@@ -358,16 +898,119 @@ async def merge_audio_files(audio_files: List[str], output_path: str) -> str:
         raise HTTPException(status_code=500, detail=f"Audio merge error: {str(e)}")
 
 
+def probe_audio_format(audio_file: str) -> tuple:
+    """ffprobe로 첫 오디오 스트림의 (코덱, 샘플레이트, 채널 수) 확인"""
+    result = subprocess.run(
+        [
+            '/usr/bin/ffprobe', '-v', 'error', '-select_streams', 'a:0',
+            '-show_entries', 'stream=codec_name,sample_rate,channels',
+            '-of', 'json', audio_file,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    streams = orjson.loads(result.stdout).get("streams") or [{}]
+    stream = streams[0]
+    return (stream.get("codec_name"), str(stream.get("sample_rate")), stream.get("channels"))
+
+
+def probe_audio_duration_ms(audio_file: str) -> int:
+    """ffprobe로 컨테이너 길이(ms) 확인 (PCM으로 디코딩하지 않음)"""
+    result = subprocess.run(
+        [
+            '/usr/bin/ffprobe', '-v', 'error',
+            '-show_entries', 'format=duration',
+            '-of', 'json', audio_file,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    duration = orjson.loads(result.stdout).get("format", {}).get("duration")
+    if duration is None:
+        raise ValueError(f"No duration in ffprobe output: {audio_file}")
+    return round(float(duration) * 1000)
+
+
+async def concat_audio_with_ffmpeg(audio_files: List[str], output_path: str):
+    """
+    MP3들을 하나로 병합
+
+    모든 파일의 코덱/샘플레이트/채널 수가 같으면 concat demuxer로 재인코딩 없이 이어 붙이고 (-c copy),
+    하나라도 다르면 concat 필터로 44.1kHz 스테레오에 맞춰 재인코딩
+    (포맷이 섞인 채 -c copy 하면 ffmpeg가 실패하지 않고 재생 시간이 틀어진 파일을 만듦)
+    """
+    formats = await asyncio.gather(*(run_io(probe_audio_format, f) for f in audio_files))
+    if len(set(formats)) == 1 and formats[0][0] == 'mp3':
+        await concat_audio_stream_copy(audio_files, output_path)
+        return
+
+    logger.info("[Merge] Input formats differ (%s), re-encoding", formats)
+    inputs = []
+    filters = []
+    for idx, audio_file in enumerate(audio_files):
+        inputs += ['-i', audio_file]
+        filters.append(
+            f"[{idx}:a:0]aresample={MP3_SAMPLE_RATE},aformat=channel_layouts=stereo[a{idx}]"
+        )
+    labels = "".join(f"[a{idx}]" for idx in range(len(audio_files)))
+    filters.append(f"{labels}concat=n={len(audio_files)}:v=0:a=1[out]")
+
+    await run_io(
+        subprocess.run,
+        [
+            '/usr/bin/ffmpeg', '-y', '-loglevel', 'error', *inputs,
+            '-filter_complex', ";".join(filters), '-map', '[out]',
+            *MP3_ENCODE_ARGS, output_path,
+        ],
+        check=True,
+        capture_output=True,
+    )
+
+
+async def concat_audio_stream_copy(audio_files: List[str], output_path: str):
+    """
+    포맷이 같은 MP3들을 재인코딩 없이 프레임 그대로 이어 붙임 (-c copy)
+    """
+    concat_list = f"{output_path}.concat.txt"
+    with open(concat_list, "w", encoding="utf-8") as f:
+        for audio_file in audio_files:
+            escaped = os.path.abspath(audio_file).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    try:
+        await run_io(
+            subprocess.run,
+            [
+                '/usr/bin/ffmpeg', '-y', '-loglevel', 'error',
+                '-f', 'concat', '-safe', '0', '-i', concat_list,
+                '-c', 'copy', output_path,
+            ],
+            check=True,
+            capture_output=True,
+        )
+    finally:
+        if os.path.exists(concat_list):
+            os.remove(concat_list)
+
+
 def cleanup_files(file_paths: List[str]):
     """
-    임시 파일들을 삭제
+    임시 파일들을 삭제 (존재 여부를 따로 확인하지 않고 바로 unlink)
     """
     for file_path in file_paths:
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except Exception as e:
-            print(f"Failed to delete {file_path}: {str(e)}")
+            os.unlink(file_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Failed to delete %s: %s", file_path, e)
+
+
+async def cleanup_files_async(file_paths: List[str]):
+    """
+    이벤트 루프를 막지 않도록 임시 파일 삭제를 스레드 한 번으로 처리
+    """
+    await asyncio.to_thread(cleanup_files, file_paths)
 
 
 # API Endpoints
@@ -385,7 +1028,9 @@ async def health_check():
 async def refresh_cookies():
     """YouTube 브라우저 프로필 재설정 (로그인)"""
     try:
-        success = await asyncio.to_thread(setup_browser_profile)
+        success = await asyncio.to_thread(fetch_youtube_cookies)
+        # 새 쿠키로 YoutubeDL 인스턴스 다시 생성
+        await run_io(app.state.ydl_pool.reset)
         if success:
             return {"status": "success", "message": "Browser profile refreshed and logged in"}
         else:
@@ -402,6 +1047,14 @@ async def generate_playlist(
     """
     이미지를 업로드하면 감성 분석 후 어울리는 음악을 찾아 병합하여 반환
     """
+    async with PIPELINE_SEM:
+        return await run_playlist_pipeline(background_tasks, file)
+
+
+async def run_playlist_pipeline(background_tasks: BackgroundTasks, file: UploadFile) -> dict:
+    """
+    플레이리스트 생성 파이프라인 (PIPELINE_SEM으로 동시 실행 수가 제한됨)
+    """
     session_id = str(uuid.uuid4())
     temp_files = []
 
@@ -410,77 +1063,102 @@ async def generate_playlist(
         image_path = TEMP_DIR / f"{session_id}_image.jpg"
         temp_files.append(str(image_path))
 
+        # 업로드 전체를 메모리에 올리지 않도록 1MiB 단위로 나눠서 저장
         with open(image_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+            while chunk := await file.read(1 << 20):
+                f.write(chunk)
+
+        # 2. Step 1: Analyze mood and get song recommendations with Gemini (단일 요청)
+        image_bytes = await asyncio.to_thread(image_path.read_bytes)
 
-        # 2. Step 1: Analyze mood with Gemini
-        print(f"[{session_id}] Step 1: Analyzing mood with Gemini...")
-        mood_response = await analyze_mood_with_gemini(str(image_path))
-        print(f"[{session_id}] Mood response: {mood_response}")
+        # 같은(비슷한) 이미지를 이미 분석했다면 무드 분석은 재사용하고 곡 추천만 새로 요청
+        phash = await asyncio.to_thread(image_phash, image_bytes)
+        cached_mood = lookup_mood_cache(phash)
 
-        # Parse mood JSON response
+        if cached_mood is not None:
+            logger.info("[%s] Step 1: Reusing cached mood analysis (phash %s), recommending songs with Gemini...", session_id, phash)
+            gemini_response = await recommend_songs_with_gemini(cached_mood)
+            logger.debug("[%s] Gemini response: %s", session_id, gemini_response)
+        else:
+            logger.info("[%s] Step 1: Analyzing mood and recommending songs with Gemini...", session_id)
+            # PIL로 디코딩하지 않고 원본 바이트를 그대로 전달
+            gemini_response = await analyze_and_recommend_with_gemini(
+                image_bytes, file.content_type or 'image/jpeg'
+            )
+            logger.debug("[%s] Gemini response: %s", session_id, gemini_response)
+
+        # Parse JSON response
         try:
-            mood_data = parse_gemini_json(mood_response, session_id)
-            mood = mood_data.get("mood", {})
-            analysis = mood_data.get("analysis", "")
-            print(f"[{session_id}] Mood: {mood}")
-            print(f"[{session_id}] Analysis: {analysis}")
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"[{session_id}] Raw mood response: {mood_response}")
-            raise HTTPException(status_code=500, detail=f"Failed to parse mood response: {str(e)}")
-
-        # 2.5. Generate playlist images (YouTube thumbnail + LP cover)
-        print(f"[{session_id}] Step 2.5: Generating playlist images...")
-        generated_images = await generate_playlist_images(
+            gemini_data = load_gemini_json(gemini_response, session_id)
+            if cached_mood is not None:
+                gemini_data.update(cached_mood)
+            else:
+                remember_mood(phash, gemini_data)
+            if not is_complete_playlist_data(gemini_data):
+                # 일부만 파싱된 응답으로 성공을 반환하지 않음 (프론트엔드가 mood 항목을 그대로 사용)
+                raise ValueError("Gemini response is missing mood, analysis or songs")
+            mood = gemini_data.get("mood", {})
+            analysis = gemini_data.get("analysis", "")
+            playlist_title = gemini_data.get("playlist_title", "AI 큐레이션 플레이리스트")
+            reason = gemini_data.get("reason", "")
+            songs = gemini_data.get("songs", [])
+            logger.debug("[%s] Mood: %s", session_id, mood)
+            logger.debug("[%s] Analysis: %s", session_id, analysis)
+            logger.info("[%s] Playlist Title: %s", session_id, playlist_title)
+            logger.debug("[%s] Reason: %s", session_id, reason)
+            logger.debug("[%s] Songs: %s", session_id, songs)
+        except (orjson.JSONDecodeError, ValueError) as e:
+            logger.warning("[%s] Raw Gemini response: %s", session_id, gemini_response)
+            raise HTTPException(status_code=502, detail=f"Failed to parse Gemini response: {str(e)}")
+
+        # 3. Generate playlist images (YouTube thumbnail + LP cover)
+        # 이미지 생성은 무드 결과에만 의존하므로 응답을 기다리게 하지 않고 백그라운드로 진행
+        # (이미지 다운로드 요청이 먼저 오면 /download/image에서 작업 완료를 기다림)
+        logger.info("[%s] Step 2: Generating playlist images in background...", session_id)
+        track_image_job(session_id, asyncio.create_task(generate_playlist_images(
             mood_data=mood,
             analysis=analysis,
             session_id=session_id,
             output_dir=TEMP_DIR,
             image_path=str(image_path)
-        )
+        )), str(image_path))
+        # 입력 이미지는 이미지 생성 작업이 끝난 뒤 track_image_job에서 삭제
+        temp_files.remove(str(image_path))
         # Note: Image files are NOT added to temp_files - they persist for download
         # They will be cleaned up separately or on server restart
 
-        # 3. Step 2: Get song recommendations based on mood
-        print(f"[{session_id}] Step 2: Getting song recommendations...")
-        songs_response = await recommend_songs_with_gemini(mood_data)
-        print(f"[{session_id}] Songs response: {songs_response}")
-
-        # Parse songs JSON response
-        try:
-            songs_data = parse_gemini_json(songs_response, session_id)
-            playlist_title = songs_data.get("playlist_title", "AI 큐레이션 플레이리스트")
-            reason = songs_data.get("reason", "")
-            songs = songs_data.get("songs", [])
-            print(f"[{session_id}] Playlist Title: {playlist_title}")
-            print(f"[{session_id}] Reason: {reason}")
-            print(f"[{session_id}] Songs: {songs}")
-        except (json.JSONDecodeError, ValueError) as e:
-            print(f"[{session_id}] Raw songs response: {songs_response}")
-            raise HTTPException(status_code=500, detail=f"Failed to parse songs response: {str(e)}")
-
         # 4. Download audio from YouTube (직접 검색)
-        print(f"[{session_id}] Step 3: Downloading audio files via YouTube search...")
+        logger.info("[%s] Step 3: Downloading audio files via YouTube search...", session_id)
         downloaded_files = []
+        video_ids = []
         successful_songs = []
         failed_songs = []
 
-        for idx, song in enumerate(songs):
-            output_file = str(TEMP_DIR / f"{session_id}_audio_{idx}")
-            temp_files.append(f"{output_file}.mp3")
+        output_files = [str(TEMP_DIR / f"{session_id}_audio_{idx}") for idx in range(len(songs))]
+        temp_files.extend(f"{output_file}.mp3" for output_file in output_files)
+
+        for song in songs:
+            logger.info("[%s] Searching and downloading: %s by %s", session_id, song.get('title', ''), song.get('artist', ''))
 
+        # 모든 곡을 동시에 검색/다운로드
+        results = await asyncio.gather(
+            *[
+                download_audio_by_search(song.get('title', ''), song.get('artist', ''), output_file)
+                for song, output_file in zip(songs, output_files)
+            ],
+            return_exceptions=True
+        )
+
+        for song, output_file, result in zip(songs, output_files, results):
             title = song.get('title', '')
             artist = song.get('artist', '')
-            print(f"[{session_id}] Searching and downloading: {title} by {artist}")
 
-            success = await download_audio_by_search(title, artist, output_file)
-            if success and os.path.exists(f"{output_file}.mp3"):
+            if isinstance(result, str) and os.path.exists(f"{output_file}.mp3"):
                 downloaded_files.append(f"{output_file}.mp3")
+                video_ids.append(result)
 
-                # 곡 길이 측정
-                audio = await asyncio.to_thread(AudioSegment.from_mp3, f"{output_file}.mp3")
-                duration_ms = len(audio)
+                # 곡 길이 측정 (디코딩 없이 ffprobe로 확인)
+                duration_ms = await run_io(probe_audio_duration_ms, f"{output_file}.mp3")
                 duration_sec = duration_ms / 1000
 
                 song_with_duration = {
@@ -489,15 +1167,17 @@ async def generate_playlist(
                     "duration_sec": round(duration_sec, 2)
                 }
                 successful_songs.append(song_with_duration)
-                print(f"[{session_id}] Successfully downloaded: {title} by {artist} ({duration_sec:.2f}s)")
+                logger.info("[%s] Successfully downloaded: %s by %s (%.2fs)", session_id, title, artist, duration_sec)
             else:
+                if isinstance(result, Exception):
+                    logger.warning("[%s] Download error: %s by %s: %s", session_id, title, artist, result)
                 failed_songs.append(song)
-                print(f"[{session_id}] Failed to download: {title} by {artist}")
+                logger.warning("[%s] Failed to download: %s by %s", session_id, title, artist)
 
         if not downloaded_files:
             raise HTTPException(status_code=500, detail="Failed to download any audio files")
 
-        print(f"[{session_id}] Downloaded {len(downloaded_files)}/{len(songs)} audio files")
+        logger.info("[%s] Downloaded %s/%s audio files", session_id, len(downloaded_files), len(songs))
 
         # 각 곡의 시작 시간 계산
         current_start_ms = 0
@@ -510,22 +1190,35 @@ async def generate_playlist(
         total_duration_sec = round(total_duration_ms / 1000, 2)
 
         # 5. Step 4: Merge audio files
-        print(f"[{session_id}] Merging audio files...")
-        merged_path = str(TEMP_DIR / f"playlist_{session_id}.mp3")
+        # 곡 순서까지 같은 조합이면 결과 파일이 동일하므로 video_id 순서로 이름을 정함
+        playlist_hash = playlist_hash_for(video_ids)
+        merged_path = playlist_path(playlist_hash)
 
-        await merge_audio_files(downloaded_files, merged_path)
-        print(f"[{session_id}] Merge complete: {merged_path} (total: {total_duration_sec}s)")
+        if merged_path.exists():
+            logger.info("[%s] Reusing merged playlist: %s", session_id, merged_path)
+        else:
+            logger.info("[%s] Merging audio files...", session_id)
+            # 같은 조합을 동시에 병합해도 잘린 파일이 보이지 않도록 세션별 파일에 쓴 뒤 교체
+            partial_path = TEMP_DIR / f"playlist_{playlist_hash}.{session_id}.mp3"
+            try:
+                await merge_audio_files(downloaded_files, str(partial_path))
+                os.replace(partial_path, merged_path)
+            finally:
+                partial_path.unlink(missing_ok=True)
+            logger.info("[%s] Merge complete: %s (total: %ss)", session_id, merged_path, total_duration_sec)
+
+        PLAYLIST_SESSIONS[session_id] = playlist_hash
 
         # 6. Cleanup individual audio files (keep merged file for download)
-        background_tasks.add_task(cleanup_files, temp_files)
+        background_tasks.add_task(cleanup_files_async, temp_files)
 
         # 7. Return JSON response with session_id for download
-        # Build images response
-        images_response = {}
-        if generated_images.get("youtube"):
-            images_response["youtube_thumbnail"] = f"/download/image/{session_id}?type=youtube"
-        if generated_images.get("lp"):
-            images_response["lp_cover"] = f"/download/image/{session_id}?type=lp"
+        # Build images response (생성 중이어도 URL은 항상 포함, 진행/실패 여부는 status_url로 확인)
+        images_response = {
+            "youtube_thumbnail": f"/download/image/{session_id}?type=youtube",
+            "lp_cover": f"/download/image/{session_id}?type=lp",
+            "status_url": f"/images/{session_id}/status",
+        }
 
         return {
             "success": True,
@@ -549,39 +1242,60 @@ async def generate_playlist(
 
     except HTTPException:
         # Cleanup on error
-        cleanup_files(temp_files)
+        cancel_image_job(session_id)
+        await cleanup_files_async(temp_files)
         raise
     except Exception as e:
         # Cleanup on error
-        cleanup_files(temp_files)
+        cancel_image_job(session_id)
+        await cleanup_files_async(temp_files)
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 
 @app.get("/download/{session_id}")
-async def download_playlist(session_id: str, background_tasks: BackgroundTasks):
+async def download_playlist(session_id: str, request: Request, background_tasks: BackgroundTasks):
     """
     생성된 플레이리스트 MP3 파일 다운로드
     """
-    file_path = TEMP_DIR / f"playlist_{session_id}.mp3"
+    playlist_hash = PLAYLIST_SESSIONS.get(session_id)
+    file_path = playlist_path(playlist_hash) if playlist_hash else None
 
-    if not file_path.exists():
+    if file_path is None or not file_path.exists():
         raise HTTPException(status_code=404, detail="File not found or expired")
 
+    # 파일 이름이 곡 조합 해시라 내용이 바뀌지 않으므로 그대로 ETag로 사용
+    etag = f'"{playlist_hash}"'
+    cache_headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+
     # Schedule cleanup after download (10 seconds delay to ensure download completes)
     async def delayed_cleanup():
-        import asyncio
         await asyncio.sleep(10)
-        cleanup_files([str(file_path)])
+        await release_playlist(session_id)
 
     background_tasks.add_task(delayed_cleanup)
 
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers)
+
     return FileResponse(
         path=str(file_path),
         filename=f"playlist_{session_id}.mp3",
-        media_type="audio/mpeg"
+        media_type="audio/mpeg",
+        headers=cache_headers
     )
 
 
+@app.get("/images/{session_id}/status")
+async def image_status(session_id: str):
+    """
+    이미지 생성 상태 조회 ("pending" / "ready" / "failed" / "unknown")
+    """
+    return {image_type: get_image_status(session_id, image_type) for image_type in IMAGE_TYPES}
+
+
 @app.get("/download/image/{session_id}")
 async def download_image(session_id: str, type: str, background_tasks: BackgroundTasks):
     """
@@ -591,12 +1305,30 @@ async def download_image(session_id: str, type: str, background_tasks: Backgroun
         session_id: 세션 ID
         type: 이미지 타입 ("youtube" 또는 "lp")
     """
-    if type == "youtube":
-        file_path = TEMP_DIR / f"{session_id}_youtube.png"
-    elif type == "lp":
-        file_path = TEMP_DIR / f"{session_id}_lp.png"
-    else:
+    if type not in IMAGE_TYPES:
         raise HTTPException(status_code=400, detail="Invalid image type. Use 'youtube' or 'lp'")
+    file_path = image_output_path(session_id, type)
+
+    # 아직 생성 중이면 완료될 때까지 대기 (요청이 끊겨도 작업은 취소되지 않도록 shield)
+    job = IMAGE_JOBS.get(session_id)
+    if job is not None and not file_path.exists():
+        try:
+            await asyncio.wait_for(asyncio.shield(job), timeout=IMAGE_JOB_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=503,
+                detail="Image generation still in progress",
+                headers={"Retry-After": "5"}
+            )
+        except asyncio.CancelledError:
+            # 파이프라인 실패로 작업이 취소된 경우만 처리 (요청 자체가 취소된 경우는 그대로 전파)
+            if not job.cancelled():
+                raise
+        except Exception:
+            pass
+
+    if get_image_status(session_id, type) == "failed":
+        raise HTTPException(status_code=404, detail="Image generation failed")
 
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="Image not found or expired")
@@ -610,4 +1342,11 @@ async def download_image(session_id: str, type: str, background_tasks: Backgroun
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=True,
+        loop="uvloop",
+        http="httptools"
+    )
@@ -83,6 +83,7 @@ export default function PlaylistPage({ data, originalImage, onRegenerate, onRese
   const [currentTime, setCurrentTime] = useState(0)
   const [currentTrackIndex, setCurrentTrackIndex] = useState(0)
   const [moodValues, setMoodValues] = useState<MoodSliders>(data.moodSliders)
+  const [failedImageUrls, setFailedImageUrls] = useState<string[]>([])
   const audioRef = useRef<HTMLAudioElement>(null)
   const progressBarRef = useRef<HTMLDivElement>(null)
 
@@ -92,6 +93,11 @@ export default function PlaylistPage({ data, originalImage, onRegenerate, onRese
     { type: "원본", url: originalImage },
   ]
 
+  // 이미지 생성 실패(404)로 불러오지 못한 이미지는 placeholder로 표시
+  const currentImageUrl = images[currentImageIndex].url
+  const currentImageSrc =
+    currentImageUrl && !failedImageUrls.includes(currentImageUrl) ? currentImageUrl : "/placeholder.svg"
+
   const progress = data.totalDuration > 0 ? (currentTime / data.totalDuration) * 100 : 0
 
   useEffect(() => {
@@ -186,10 +192,16 @@ export default function PlaylistPage({ data, originalImage, onRegenerate, onRese
         onClick={handleImageAreaClick}
       >
         <img
-          src={images[currentImageIndex].url || "/placeholder.svg"}
+          src={currentImageSrc}
           alt={images[currentImageIndex].type}
           className="w-full h-full object-cover pointer-events-none select-none"
           draggable={false}
+          onError={() => {
+            // placeholder까지 실패해도 다시 시도하지 않도록 실패한 URL만 기록
+            if (currentImageUrl && currentImageSrc === currentImageUrl) {
+              setFailedImageUrls((prev) => [...prev, currentImageUrl])
+            }
+          }}
         />
 
         {/* Controls overlay */}
@@ -54,6 +54,7 @@ interface ApiResponse {
   images?: {
     youtube_thumbnail?: string
     lp_cover?: string
+    status_url?: string
   }
 }
 